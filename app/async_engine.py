@@ -0,0 +1,475 @@
+import asyncio
+import contextlib
+import importlib.util
+import time
+from urllib.parse import urlencode, urlparse
+import requests
+from checkpoint import CheckpointStore, CHECKPOINT_PATH
+from concurrency import AdaptiveLimiter, INITIAL_LIMIT, register_limiter
+from config_migrator import (CATALOG_INCLUDE, SHARED_CODE_COMPONENT, select_catalog_configs, missing_config_keys, fill_config_details,
+                             component_config_entries, kept_component_ids,
+                             config_values, row_values, plan_config_writes, configs_path, rows_path, metadata_path, check_updated,
+                             collect_row_results, row_checkpoint, failed_result, config_outcome, ConfigSchedule)
+from destination_index import DESTINATION_INCLUDE, build_destination_index
+from fanout import destination_summary, planned_configs
+from history import HistoryStore, HISTORY_PATH
+from journal import RunJournal
+from json_codec import response_json
+from keboola_client import (RequestTrace, next_retry, encode_json_body, DEFAULT_TIMEOUT, RETRY_STATUSES, IDEMPOTENT_METHODS, MAX_RETRIES,
+                            DEFAULT_COMPRESS_MIN_BYTES, is_compression_rejected)
+from metadata import metadata_key, metadata_payload, relevant_metadata
+from metrics import get_metrics
+from source_snapshot import build_source_snapshot
+
+# asyncio engine: the same reads and writes as the thread engine, but every in-flight request is a coroutine instead of a
+# thread, so a run can keep thousands of requests in flight. aiohttp is only needed, and only imported, when this engine
+# runs, so the thread engine does not pay for loading it.
+aiohttp = None
+
+# In-flight Storage API requests across the whole run and per destination project
+DEFAULT_ASYNC_GLOBAL_IN_FLIGHT = 2048
+DEFAULT_ASYNC_DESTINATION_IN_FLIGHT = 512
+# Upper bound of the adaptive per-host limit; it starts at the thread engine's limit and grows from there
+ASYNC_MAX_LIMIT = 4096
+
+
+def is_available():
+    return aiohttp is not None or importlib.util.find_spec('aiohttp') is not None
+
+
+def require_aiohttp():
+    global aiohttp
+    if aiohttp is None:
+        try:
+            import aiohttp
+        except ImportError:
+            raise RuntimeError('The asyncio engine needs the aiohttp package: pip install aiohttp')
+
+
+def connection_errors():
+    return (aiohttp.ClientConnectionError, asyncio.TimeoutError)
+
+
+def client_timeout(timeout):
+    # (connect, read) seconds, as KeboolaClient takes them
+    connect_timeout, read_timeout = timeout
+    return aiohttp.ClientTimeout(total=None, sock_connect=connect_timeout, sock_read=read_timeout)
+
+
+class AsyncAdaptiveLimiter(AdaptiveLimiter):
+    # The AIMD limit of AdaptiveLimiter for coroutines of one event loop; waiting for a slot never blocks the loop
+
+    def __init__(self, initial=INITIAL_LIMIT, max_limit=ASYNC_MAX_LIMIT):
+        super().__init__(initial, max_limit=max_limit, slow_start=True)
+        self._slots = asyncio.Condition()
+
+    async def acquire(self):
+        async with self._slots:
+            await self._slots.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def release(self, throttled=False):
+        async with self._slots:
+            self.in_flight -= 1
+            self._adjust(throttled)
+            self._slots.notify_all()
+
+
+class ApiResponse:
+    # Response read in full, so it outlives the aiohttp connection it came from
+
+    def __init__(self, method, url, status_code, headers, content, bytes_sent):
+        self.method = method
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.bytes_sent = bytes_sent
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', errors='replace')
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(f'{self.status_code} Error for {self.method} {self.url}: {self.text[:200]}')
+
+
+class AsyncKeboolaClient:
+    # Storage API client for one project on a shared aiohttp session. Mirrors KeboolaClient: retries with backoff,
+    # the adaptive host limit, compressed large bodies and request metrics.
+
+    def __init__(self, session, url, token, limiter, in_flight=None, global_limit=None, max_retries=MAX_RETRIES,
+                 compress_min_bytes=DEFAULT_COMPRESS_MIN_BYTES):
+        self.session = session
+        self.url = url if url.endswith('/') else f'{url}/'
+        self.token = token
+        self.limiter = limiter
+        self.in_flight = in_flight
+        self.global_limit = global_limit
+        self.max_retries = max_retries
+        self.compress_min_bytes = compress_min_bytes
+
+    async def send(self, method, path, data=None, params=None, headers=None, timeout=None):
+        # Same order as KeboolaClient.send: project cap, shared cap, host limiter
+        async with self.in_flight or contextlib.nullcontext(), self.global_limit or contextlib.nullcontext():
+            await self.limiter.acquire()
+            throttled = False
+            started = time.monotonic()
+            try:
+                async with self.session.request(method, f'{self.url}{path}', data=data, params=params,
+                                                headers=dict(headers or {}, **{'X-StorageApi-Token': self.token}),
+                                                **({'timeout': client_timeout(timeout)} if timeout else {})) as raw:
+                    content = await raw.read()
+                response = ApiResponse(method, f'{self.url}{path}', raw.status, raw.headers, content, len(data or b''))
+                throttled = response.status_code in RETRY_STATUSES
+                get_metrics().observe_request(method, path, response.status_code, time.monotonic() - started, response.bytes_sent, len(content))
+                return response
+            except connection_errors() as e:
+                throttled = True
+                get_metrics().observe_request(method, path, type(e).__name__, time.monotonic() - started)
+                raise
+            finally:
+                await self.limiter.release(throttled)
+
+    async def request(self, method, path, retry=None, trace=None, json=None, data=None, params=None, timeout=None):
+        # json= bodies are encoded once and compressed when large, data= dicts are form-encoded, as with KeboolaClient.
+        # timeout is (connect, read) seconds for this call; the session's DEFAULT_TIMEOUT applies otherwise.
+        headers = {}
+        if isinstance(data, dict):
+            data = urlencode(data).encode('utf-8')
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        if json is None:
+            return await self._request(method, path, retry, trace, data, params, headers, timeout)
+
+        body, compressed = encode_json_body(json, self.compress_min_bytes)
+        headers['Content-Type'] = 'application/json'
+        if compressed is None:
+            return await self._request(method, path, retry, trace, body, params, headers, timeout)
+
+        response = await self._request(method, path, retry, trace, compressed, params, dict(headers, **{'Content-Encoding': 'gzip'}), timeout)
+        if not is_compression_rejected(response):
+            return response
+        response = await self._request(method, path, retry, trace, body, params, headers, timeout)
+        if not is_compression_rejected(response):
+            self.compress_min_bytes = None
+        return response
+
+    async def _request(self, method, path, retry, trace, data, params, headers, timeout):
+        retry = method in IDEMPOTENT_METHODS if retry is None else retry
+
+        attempt = 0
+        while True:
+            try:
+                response = await self.send(method, path, data, params, headers, timeout)
+                error = None
+                if trace is not None:
+                    trace.add(response.status_code, response.bytes_sent, len(response.content))
+            except connection_errors() as e:
+                response = None
+                error = e
+
+            retry_after = next_retry(response, error, retry, attempt, self.max_retries)
+            if retry_after is None:
+                if error is not None:
+                    raise error
+                return response
+
+            reason, delay = retry_after
+            self.limiter.record_retry(reason)
+            get_metrics().record_retry(method, path, reason)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def get(self, path, **kwargs):
+        return await self.request('GET', path, **kwargs)
+
+    async def post(self, path, **kwargs):
+        return await self.request('POST', path, **kwargs)
+
+    async def put(self, path, **kwargs):
+        return await self.request('PUT', path, **kwargs)
+
+
+class AsyncClients:
+    # One pooled aiohttp session and one adaptive limiter per API host for a whole run
+
+    def __init__(self, max_connections):
+        self.max_connections = max_connections
+        self.limiters = {}
+        self.session = None
+
+    async def __aenter__(self):
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.max_connections, limit_per_host=0, ttl_dns_cache=300),
+            timeout=client_timeout(DEFAULT_TIMEOUT),
+            # Content-Encoding and Content-Type are set per request; aiohttp would otherwise add its own
+            skip_auto_headers=('Content-Type',))
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.session.close()
+
+    def client(self, url, token, max_in_flight=None, global_limit=None):
+        host = urlparse(url).netloc
+        if host not in self.limiters:
+            # Registered, so get_limiter_stats reports the limit and retries this engine reached
+            self.limiters[host] = register_limiter(f'{host} (asyncio)', AsyncAdaptiveLimiter())
+        limiter = self.limiters[host]
+        return AsyncKeboolaClient(self.session, url, token, limiter, asyncio.Semaphore(max_in_flight) if max_in_flight else None, global_limit)
+
+
+async def load_component_catalog(client, include=CATALOG_INCLUDE):
+    response = await client.get('v2/storage/components', params={'include': include} if include else None)
+    response.raise_for_status()
+    return response_json(response)
+
+
+async def get_configuration_detail(client, component_id, configuration_id):
+    response = await client.get(f'v2/storage/components/{component_id}/configs/{configuration_id}')
+    response.raise_for_status()
+    return dict(response_json(response), component_id=component_id)
+
+
+async def get_keboola_configs(client, entries):
+    details = await asyncio.gather(*(get_configuration_detail(client, component_id, config_id) for component_id, config_id in missing_config_keys(entries)))
+    return fill_config_details(entries, details)
+
+
+async def list_component_configs(client, component_id):
+    response = await client.get(f'v2/storage/components/{component_id}/configs')
+    response.raise_for_status()
+    return response_json(response)
+
+
+async def get_component_configs(client, component_id):
+    return await get_keboola_configs(client, component_config_entries(component_id, await list_component_configs(client, component_id)))
+
+
+async def get_selected_configs(client, keep=None, selected_configs=None):
+    # config_migrator.get_selected_configs: narrow selections never take the bulk listing of bodies
+    if selected_configs:
+        return list(await asyncio.gather(*(get_configuration_detail(client, config[0], config[2]) for config in selected_configs)))
+    component_ids = kept_component_ids(await load_component_catalog(client, include=None), keep)
+    results = await asyncio.gather(*(get_component_configs(client, component_id) for component_id in component_ids))
+    return [config for configs in results for config in configs]
+
+
+async def get_config_metadata(client, component_id, config_id, BRANCH='default'):
+    response = await client.get(f'v2/storage/branch/{BRANCH}/components/{component_id}/configs/{config_id}/metadata')
+    response.raise_for_status()
+    return relevant_metadata(response_json(response))
+
+
+async def prefetch_metadata(client, configs, BRANCH='default'):
+    keys = [(config['component_id'], config['id']) for config in configs]
+    results = await asyncio.gather(*(get_config_metadata(client, component_id, config_id, BRANCH) for component_id, config_id in keys))
+    return {metadata_key(*key): items for key, items in zip(keys, results) if items}
+
+
+async def load_destination_index(client, BRANCH_DEST):
+    response = await client.get(f'v2/storage/branch/{BRANCH_DEST}/components', params={'include': DESTINATION_INCLUDE})
+    response.raise_for_status()
+    return build_destination_index(response_json(response))
+
+
+async def _load_source_snapshot(source_project, skip, keep, selected_configs, include_shared_code, report, global_in_flight):
+    async with AsyncClients(global_in_flight) as clients:
+        client = clients.client(source_project['url'], source_project['token'], global_in_flight)
+        # Same reads as engine.load_source_snapshot: one bulk listing for full and Skip reads, only the selection otherwise
+        if selected_configs or keep:
+            catalog = None
+            configs = await get_selected_configs(client, keep, selected_configs)
+        else:
+            catalog = await load_component_catalog(client)
+            configs = await get_keboola_configs(client, select_catalog_configs(catalog, skip, keep, selected_configs, report))
+        shared_code_configs = []
+        if include_shared_code and catalog is None:
+            shared_code_configs = await get_component_configs(client, SHARED_CODE_COMPONENT)
+        elif include_shared_code:
+            shared_code_configs = await get_keboola_configs(client, select_catalog_configs(catalog, keep=[SHARED_CODE_COMPONENT]))
+        metadata = await prefetch_metadata(client, configs + shared_code_configs)
+    return build_source_snapshot(source_project['name'], client.url, configs, shared_code_configs, metadata)
+
+
+def load_source_snapshot(source_project, skip=None, keep=None, selected_configs=None, include_shared_code=False, report=None,
+                         global_in_flight=DEFAULT_ASYNC_GLOBAL_IN_FLIGHT):
+    # engine.load_source_snapshot on the asyncio engine; detail and metadata reads all go out at once
+    require_aiohttp()
+    return asyncio.run(_load_source_snapshot(source_project, skip, keep, selected_configs, include_shared_code, report, global_in_flight))
+
+
+async def write_config(client, BRANCH_DEST, componentId, configurationId, values, state=None, trace=None):
+    # config_migrator.write_config as a coroutine
+    if state != 'updated':
+        response = await client.post(configs_path(BRANCH_DEST, componentId), json=values, retry=True, trace=trace)
+        if response.status_code == 201:
+            return 'created'
+
+    return check_updated(await client.put(f'{configs_path(BRANCH_DEST, componentId)}/{configurationId}', json=values, trace=trace), 'config')
+
+
+async def write_row(client, BRANCH_DEST, componentId, configurationId, row, state=None, trace=None, on_row_done=None):
+    rowId = row['id']
+    values_row = row_values(row)
+
+    result = None
+    if state != 'updated':
+        response = await client.post(rows_path(BRANCH_DEST, componentId, configurationId), json=values_row, retry=True, trace=trace)
+        if response.status_code == 201:
+            result = 'created'
+
+    if result is None:
+        result = check_updated(await client.put(f'{rows_path(BRANCH_DEST, componentId, configurationId)}/{rowId}', json=values_row, trace=trace),
+                               f'row {rowId}')
+
+    if on_row_done:
+        on_row_done(row)
+    return result
+
+
+async def write_rows(client, BRANCH_DEST, componentId, configurationId, rows_to_write, trace=None, on_row_done=None):
+    # Every row of the config at once; the request semaphores decide how many actually go out
+    return collect_row_results(await asyncio.gather(*(write_row(client, BRANCH_DEST, componentId, configurationId, row, state, trace, on_row_done)
+                                                      for row, state in rows_to_write), return_exceptions=True))
+
+
+async def migrate_config(config, client, BRANCH_DEST, source_name, destination_name, index=None, incremental=False, journal=None,
+                         checkpoint=None, metadata=None):
+    # config_migrator.migrate_config as a coroutine, with the same plan, journal records and checkpoints
+    started = time.monotonic()
+    trace = RequestTrace()
+    try:
+        configurationId = config['id']
+        componentId = config['component_id']
+        values = config_values(config)
+
+        config_state, rows_to_write, counts = plan_config_writes(config, index, incremental, checkpoint)
+
+        if config_state == 'unchanged' and not rows_to_write:
+            counts['configs_unchanged'] += 1
+            return config_outcome(config, 'Unchanged', source_name, destination_name, started, trace, journal, checkpoint, counts)
+
+        if config_state != 'unchanged':
+            counts[f'configs_{await write_config(client, BRANCH_DEST, componentId, configurationId, values, config_state, trace)}'] += 1
+            if metadata:
+                await client.post(metadata_path(BRANCH_DEST, componentId, configurationId), data=metadata_payload(metadata), retry=True, trace=trace)
+        else:
+            counts['configs_unchanged'] += 1
+
+        for row_state in await write_rows(client, BRANCH_DEST, componentId, configurationId, rows_to_write, trace, row_checkpoint(checkpoint, config)):
+            counts[f'rows_{row_state}'] += 1
+        return config_outcome(config, 'Success', source_name, destination_name, started, trace, journal, checkpoint, counts)
+
+    except Exception as e:
+        return config_outcome(config, 'Failed', source_name, destination_name, started, trace, journal, error=e)
+
+
+async def migrate_configs(configs_src, client, BRANCH_DEST, source_name, destination_name, config_slots, report=None, on_progress=None,
+                          index=None, counts=None, incremental=False, journal=None, checkpoint=None, metadata=None):
+    # config_migrator.migrate_configs on the event loop, with the same ConfigSchedule; config_slots bounds the configs being
+    # migrated at once, so the journal durations do not include time spent queueing
+    report = report or (lambda message: None)
+    metadata = metadata or {}
+    schedule = ConfigSchedule(configs_src, on_progress, counts, journal, source_name, destination_name)
+    tasks = {}
+
+    report(f'Proceeding to migrate {len(schedule)} configurations...')
+
+    async def run(config):
+        async with config_slots:
+            return await migrate_config(config, client, BRANCH_DEST, source_name, destination_name, index, incremental, journal, checkpoint,
+                                        metadata.get(metadata_key(config['component_id'], config['id'])))
+
+    def submit(keys):
+        for key in keys:
+            tasks[asyncio.ensure_future(run(schedule.config(key)))] = key
+
+    submit(schedule.start())
+    while tasks or schedule.pending:
+        if not tasks:
+            submit(schedule.release_cycles())
+
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            key = tasks.pop(task)
+            try:
+                result = task.result()
+            except Exception as exc:
+                result = failed_result(schedule.config(key), exc)
+            submit(schedule.record(key, result))
+
+    for message in schedule.log_messages:
+        report(message)
+
+    return schedule.fails
+
+
+async def migrate_destination(clients, snapshot, dest_project, BRANCH_DEST, global_limit, destination_in_flight, on_event, incremental=False,
+                              journal=None, checkpoint=None):
+    destination_name = dest_project['name']
+    client = clients.client(dest_project['url'], dest_project['token'], destination_in_flight, global_limit)
+
+    configs, resumed = planned_configs(snapshot, checkpoint)
+    total = len(configs)
+    summary = destination_summary(destination_name, total, resumed)
+
+    def report(message):
+        on_event({'type': 'message', 'destination': destination_name, 'message': message})
+
+    def progress(config, success, messages):
+        summary['migrated' if success else 'failed'] += 1
+        on_event({'type': 'config_done', 'destination': destination_name, 'config': config, 'success': success,
+                  'messages': messages, 'done': summary['migrated'] + summary['failed'], 'total': total})
+
+    on_event({'type': 'destination_started', 'destination': destination_name, 'total': total, 'resumed': resumed})
+    try:
+        index = await load_destination_index(client, BRANCH_DEST)
+        summary['fails'].extend(await migrate_configs(configs, client, BRANCH_DEST, snapshot.source_name, destination_name,
+                                                      asyncio.Semaphore(destination_in_flight), report, progress, index, summary['counts'],
+                                                      incremental, journal, checkpoint, snapshot.metadata))
+    except Exception as e:
+        summary['error'] = str(e)
+        summary['connection_error'] = isinstance(e, connection_errors() + (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+
+    on_event(dict(summary, type='destination_finished'))
+    return summary
+
+
+async def _migrate_destinations(snapshot, destinations, BRANCH_DEST, max_destinations, global_in_flight, destination_in_flight, on_event,
+                                incremental, journal, checkpoints, run_id, resume):
+    global_limit = asyncio.Semaphore(global_in_flight)
+    destination_slots = asyncio.Semaphore(max(1, max_destinations))
+
+    async def run(clients, dest_project):
+        async with destination_slots:
+            return await migrate_destination(clients, snapshot, dest_project, BRANCH_DEST, global_limit, destination_in_flight, on_event, incremental, journal,
+                                             checkpoints.scope(run_id, snapshot.source_name, dest_project['name'], resume) if checkpoints else None)
+
+    async with AsyncClients(global_in_flight) as clients:
+        results = await asyncio.gather(*(run(clients, dest_project) for dest_project in destinations), return_exceptions=True)
+
+    summaries = {}
+    for dest_project, result in zip(destinations, results):
+        if isinstance(result, Exception):
+            result = destination_summary(dest_project['name'], error=str(result))
+        summaries[dest_project['name']] = result
+    return summaries
+
+
+def migrate_destinations(snapshot, destinations, BRANCH_DEST='default', max_destinations=None, global_in_flight=DEFAULT_ASYNC_GLOBAL_IN_FLIGHT,
+                         destination_in_flight=DEFAULT_ASYNC_DESTINATION_IN_FLIGHT, on_event=None, incremental=False, jsonl_path=None, run_id=None,
+                         resume=False, checkpoint_path=CHECKPOINT_PATH, history_path=HISTORY_PATH):
+    # fanout.migrate_destinations on the asyncio engine, with the same arguments, events, journal, checkpoints and summaries.
+    # Runs its own event loop, so call it from a plain thread. Without max_destinations every destination starts at once.
+    require_aiohttp()
+    on_event = on_event or (lambda event: None)
+
+    checkpoints = CheckpointStore(checkpoint_path) if run_id else None
+    if checkpoints and not resume:
+        checkpoints.reset(run_id)
+
+    history = HistoryStore(history_path) if history_path else None
+    with RunJournal(jsonl_path=jsonl_path, history=history, run_id=run_id) as journal, checkpoints or contextlib.nullcontext():
+        return asyncio.run(_migrate_destinations(snapshot, destinations, BRANCH_DEST, max_destinations or len(destinations), global_in_flight,
+                                                 destination_in_flight, on_event, incremental, journal, checkpoints, run_id, resume))
@@ -0,0 +1,74 @@
+import threading
+import time
+from config_migrator import load_component_catalog, list_component_ids, list_component_configurations
+
+# Source catalog queries remembered across Streamlit reruns. Entries are keyed by project URL, token and query,
+# and are read from the API again only after CATALOG_TTL seconds or an explicit clear. Only the name and ID listings the
+# widgets use are cached; configuration bodies are always read fresh when the snapshot is loaded.
+CATALOG_TTL = 600
+
+
+class CatalogCache:
+
+    def __init__(self, ttl=CATALOG_TTL):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+        # One lock per key, so concurrent reruns wait for a single load instead of each calling the API
+        self._loading = {}
+
+    def get(self, client, query, load):
+        key = (client.url, client.token, query)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and time.monotonic() - entry[0] < self.ttl:
+                return entry[1]
+            loading = self._loading.setdefault(key, threading.Lock())
+
+        with loading:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry and time.monotonic() - entry[0] < self.ttl:
+                    return entry[1]
+            value = load()
+            with self._lock:
+                self._entries[key] = (time.monotonic(), value)
+            return value
+
+    def age(self, client, query):
+        # Seconds since the query was loaded, None when it is not cached
+        with self._lock:
+            entry = self._entries.get((client.url, client.token, query))
+        return time.monotonic() - entry[0] if entry else None
+
+    def clear(self, client=None):
+        with self._lock:
+            if client is None:
+                self._entries.clear()
+                return
+            for key in [key for key in self._entries if key[:2] == (client.url, client.token)]:
+                del self._entries[key]
+
+
+_cache = CatalogCache()
+
+
+def get_catalog_cache():
+    return _cache
+
+
+def cached_component_catalog(client):
+    # Component and configuration names and IDs, without bodies; every filter below is answered from this one listing
+    return _cache.get(client, ('components',), lambda: load_component_catalog(client, include=None))
+
+
+def cached_component_ids(client):
+    return list_component_ids(cached_component_catalog(client))
+
+
+def cached_component_configurations(client, COMPONENT_IDS=None, MODE=None):
+    return list_component_configurations(cached_component_catalog(client), COMPONENT_IDS, MODE)
+
+
+def catalog_age(client):
+    return _cache.age(client, ('components',))
@@ -0,0 +1,135 @@
+import contextlib
+import datetime
+import hashlib
+import json
+import queue
+import sqlite3
+import threading
+
+CHECKPOINT_PATH = 'checkpoints.db'
+BATCH_SIZE = 500
+# Config-level checkpoints use an empty row ID
+CONFIG_ROW = ''
+
+
+def make_run_id(snapshot, destination_names):
+    # Same source, selection and destinations give the same run ID, which is what lets a resume find its checkpoints
+    keys = sorted(f"{config['component_id']}/{config['id']}" for config in snapshot.configs + snapshot.shared_code_configs)
+    payload = json.dumps({'source': snapshot.source_name, 'configs': keys, 'destinations': sorted(destination_names)})
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()[:16]
+
+
+def make_stream_run_id(source_name, skip, keep, selected_configs, include_shared_code, destination_names):
+    # A streamed run has no snapshot to hash, so it is identified by the selection that drives the source reads
+    selection = {
+        'skip': sorted(skip or []),
+        'keep': sorted(keep or []),
+        'configs': sorted(f'{config[0]}/{config[2]}' for config in selected_configs or []),
+        'shared_code': bool(include_shared_code),
+    }
+    payload = json.dumps({'source': source_name, 'selection': selection, 'destinations': sorted(destination_names)})
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()[:16]
+
+
+class CheckpointStore:
+    # Durable record of every config and row a run has completed, written in batches by a single thread
+
+    def __init__(self, path=CHECKPOINT_PATH):
+        self.path = path
+        self._queue = queue.Queue()
+        self._thread = None
+        with contextlib.closing(self._connect()) as connection, connection:
+            connection.execute('''
+                CREATE TABLE IF NOT EXISTS checkpoints (
+                    run_id TEXT NOT NULL,
+                    source_project TEXT NOT NULL,
+                    destination_project TEXT NOT NULL,
+                    component_id TEXT NOT NULL,
+                    config_id TEXT NOT NULL,
+                    row_id TEXT NOT NULL,
+                    completed_at TEXT NOT NULL,
+                    PRIMARY KEY (run_id, source_project, destination_project, component_id, config_id, row_id)
+                )''')
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.execute('PRAGMA journal_mode=WAL')
+        return connection
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='checkpoint-writer', daemon=True)
+            self._thread.start()
+
+    def close(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def mark(self, run_id, source_project, destination_project, component_id, config_id, row_id=CONFIG_ROW):
+        self._queue.put((run_id, source_project, destination_project, component_id, str(config_id), str(row_id),
+                         datetime.datetime.now().replace(microsecond=0).isoformat()))
+
+    def completed(self, run_id, source_project, destination_project):
+        with contextlib.closing(self._connect()) as connection:
+            rows = connection.execute('SELECT component_id, config_id, row_id FROM checkpoints WHERE run_id = ? AND source_project = ? AND destination_project = ?',
+                                      (run_id, source_project, destination_project))
+            return {(component_id, config_id, row_id) for component_id, config_id, row_id in rows}
+
+    def reset(self, run_id):
+        with contextlib.closing(self._connect()) as connection, connection:
+            connection.execute('DELETE FROM checkpoints WHERE run_id = ?', (run_id,))
+
+    def scope(self, run_id, source_project, destination_project, resume=False):
+        done = self.completed(run_id, source_project, destination_project) if resume else set()
+        return CheckpointScope(self, run_id, source_project, destination_project, done)
+
+    def _run(self):
+        connection = self._connect()
+        try:
+            closed = False
+            while not closed:
+                item = self._queue.get()
+                batch = []
+                while True:
+                    if item is None:
+                        closed = True
+                        break
+                    batch.append(item)
+                    if len(batch) >= BATCH_SIZE:
+                        break
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+
+                if batch:
+                    with connection:
+                        connection.executemany('INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?, ?, ?)', batch)
+        finally:
+            connection.close()
+
+
+class CheckpointScope:
+    # Checkpoints of one (run, source project, destination project)
+
+    def __init__(self, store, run_id, source_project, destination_project, done):
+        self.store = store
+        self.run_id = run_id
+        self.source_project = source_project
+        self.destination_project = destination_project
+        self.done = done
+
+    def is_done(self, component_id, config_id, row_id=CONFIG_ROW):
+        return (component_id, str(config_id), str(row_id)) in self.done
+
+    def mark(self, component_id, config_id, row_id=CONFIG_ROW):
+        self.store.mark(self.run_id, self.source_project, self.destination_project, component_id, config_id, row_id)
@@ -0,0 +1,85 @@
+import collections
+import threading
+import time
+
+# AIMD bounds for the number of concurrent requests against one API host
+INITIAL_LIMIT = 8
+MIN_LIMIT = 1
+MAX_LIMIT = 64
+DECREASE_FACTOR = 0.5
+# Back off at most once per window, so a burst of 429s from the same wave halves the limit only once
+DECREASE_COOLDOWN = 1.0
+
+
+class AdaptiveLimiter:
+    # Additive-increase / multiplicative-decrease concurrency limit for one API host
+
+    def __init__(self, initial=INITIAL_LIMIT, min_limit=MIN_LIMIT, max_limit=MAX_LIMIT, slow_start=False):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        # Slow start: +1 per successful request (doubling every round trip) until the first throttled one
+        self.slow_start = slow_start
+        self.in_flight = 0
+        self.retries = collections.Counter()
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self, throttled=False):
+        with self._condition:
+            self.in_flight -= 1
+            self._adjust(throttled)
+            self._condition.notify_all()
+
+    def _adjust(self, throttled):
+        now = time.monotonic()
+        if throttled:
+            self.slow_start = False
+            if now - self._last_decrease >= DECREASE_COOLDOWN:
+                self.limit = max(self.min_limit, self.limit * DECREASE_FACTOR)
+                self._last_decrease = now
+        else:
+            # Roughly +1 per limit's worth of successful requests
+            self.limit = min(self.max_limit, self.limit + (1 if self.slow_start else 1 / self.limit))
+
+    def record_retry(self, reason):
+        with self._condition:
+            self.retries[reason] += 1
+
+    def stats(self):
+        with self._condition:
+            return {'limit': int(self.limit), 'in_flight': self.in_flight, 'retries': dict(self.retries)}
+
+
+_limiters = {}
+_registered_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(host):
+    with _limiters_lock:
+        if host not in _limiters:
+            _limiters[host] = AdaptiveLimiter()
+        return _limiters[host]
+
+
+def register_limiter(name, limiter):
+    # Limiters the asyncio engine creates per run; retries already counted under the name carry over to the new one
+    with _limiters_lock:
+        previous = _registered_limiters.get(name)
+        if previous is not None:
+            limiter.retries.update(previous.retries)
+        _registered_limiters[name] = limiter
+    return limiter
+
+
+def get_limiter_stats():
+    with _limiters_lock:
+        limiters = dict(_limiters, **_registered_limiters)
+    return {host: limiter.stats() for host, limiter in limiters.items()}
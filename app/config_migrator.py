@@ -1,206 +1,492 @@
-import requests
-import streamlit as st
+import collections
 import datetime
 import concurrent.futures
-import csv
+import time
+from journal import RunJournal
+from json_codec import response_json
+from keboola_client import RequestTrace
+from dependency_graph import DependencyGraph, stream_order
+from metadata import metadata_key, metadata_payload
+from metrics import get_metrics
 
 
-def get_keboola_configs(BASE, HEAD, skip=None, keep=None, selected_configs=None):
-    configs_src = []
-    
+# Embedded resources requested from the bulk components listing
+CATALOG_INCLUDE = 'configuration,rows'
+SHARED_CODE_COMPONENT = 'keboola.shared-code'
+DETAIL_WORKERS = 8
+# Concurrent row writes within one configuration
+ROW_WORKERS = 8
+
+
+def load_component_catalog(client, include=CATALOG_INCLUDE):
+    # One request returns every component together with its configurations (and rows when included)
+    params = {'include': include} if include else None
+    components_src = client.get('v2/storage/components', params=params)
+    components_src.raise_for_status()
+    return response_json(components_src)
+
+def get_configuration_detail(client, component_id, configuration_id):
+    config = client.get(f'v2/storage/components/{component_id}/configs/{configuration_id}')
+    config.raise_for_status()
+    config_out = response_json(config)
+    config_out['component_id'] = component_id
+    return config_out
+
+def get_configuration_details(client, keys):
+    # Parallel detail fetch for (component_id, configuration_id) pairs the bulk listing could not provide
+    if not keys:
+        return []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(DETAIL_WORKERS, len(keys))) as executor:
+        return list(executor.map(lambda key: get_configuration_detail(client, key[0], key[1]), keys))
+
+def is_complete_config(config):
+    return 'configuration' in config and 'rows' in config
+
+def select_catalog_configs(catalog, skip=None, keep=None, selected_configs=None, report=None):
+    # Configs to migrate, in order. Those the bulk listing did not return in full are left as (component_id, configuration_id)
+    # keys, to be filled in with detail fetches.
+    report = report or (lambda message: None)
+    entries = []
+
     if selected_configs:
+        catalog_index = {}
+        for component in catalog:
+            for config in component.get('configurations', []):
+                catalog_index[(component['id'], config['id'])] = config
+
         for config in selected_configs:
             component_id = config[0]
             configuration_id = config[2]
-            configs = requests.get(f'{BASE}v2/storage/components/{component_id}/configs/{configuration_id}', headers=HEAD)
-            config_out = configs.json()
-            config_out['component_id'] = component_id
-            configs_src.append(config_out)
+            config_out = catalog_index.get((component_id, configuration_id))
+            if config_out and is_complete_config(config_out):
+                entries.append(dict(config_out, component_id=component_id))
+            else:
+                entries.append((component_id, configuration_id))
 
     else:
-        components_src = requests.get(f'{BASE}v2/storage/components', headers=HEAD)
-        for component in components_src.json():
+        for component in catalog:
             component_id = component['id']
             if skip and component_id in skip:
-                st.write(f'Component {component_id} is skipped...')
+                report(f'Component {component_id} is skipped...')
                 continue
                 
             if keep and component_id not in keep:
-                # st.write(f'Component {component_id} is skipped...')
+                # report(f'Component {component_id} is skipped...')
                 continue
             
-            configs = requests.get(f'{BASE}v2/storage/components/{component_id}/configs', headers=HEAD)
-            for config in configs.json():
-                config['component_id'] = component_id
-                configs_src.append(config)
+            for config in component.get('configurations', []):
+                if is_complete_config(config):
+                    entries.append(dict(config, component_id=component_id))
+                else:
+                    entries.append((component_id, config['id']))
 
-    
-    return configs_src
+    return entries
 
-def get_component_ids(BASE, HEAD):
-    components_src = requests.get(f'{BASE}v2/storage/components', headers=HEAD)
-    component_ids = []
+def missing_config_keys(entries):
+    return [entry for entry in entries if isinstance(entry, tuple)]
 
-    for component in components_src.json():
-        component_id = component['id']
-        component_ids.append(component_id)
-    
-    component_ids = list(set(component_ids))
-        
-    return component_ids
+def fill_config_details(entries, details):
+    # Puts the fetched details in place of their keys, keeping the order of the selection
+    details = iter(details)
+    return [next(details) if isinstance(entry, tuple) else entry for entry in entries]
 
-def get_component_configurations(BASE, HEAD, COMPONENT_IDS=None, MODE=None):
-    configs_src = []
-    if COMPONENT_IDS and len(COMPONENT_IDS) > 0:
-        if MODE == 'keep':
-            for component_id in COMPONENT_IDS:
-                configs = requests.get(f'{BASE}v2/storage/components/{component_id}/configs', headers=HEAD)
-                for config in configs.json():
-                    configs_src.append([component_id, config['name'], config['id']])
-        elif MODE == 'skip':
-            components_src = requests.get(f'{BASE}v2/storage/components', headers=HEAD)
-            for component in components_src.json():
-                if component['id'] not in COMPONENT_IDS:
-                    component_id = component['id']
-                    configs = requests.get(f'{BASE}v2/storage/components/{component_id}/configs', headers=HEAD)
-                    for config in configs.json():
-                        configs_src.append([component_id, config['name'], config['id']])
+def get_catalog_configs(client, catalog, skip=None, keep=None, selected_configs=None, report=None):
+    # Selection from an already loaded catalog, so several selections cost a single bulk listing
+    entries = select_catalog_configs(catalog, skip, keep, selected_configs, report)
+    return fill_config_details(entries, get_configuration_details(client, missing_config_keys(entries)))
+
+def get_keboola_configs(client, skip=None, keep=None, selected_configs=None, report=None):
+    if selected_configs or keep:
+        return get_selected_configs(client, keep, selected_configs)
+    return get_catalog_configs(client, load_component_catalog(client), skip, keep, selected_configs, report)
+
+def list_component_configs(client, component_id):
+    configs = client.get(f'v2/storage/components/{component_id}/configs')
+    configs.raise_for_status()
+    return response_json(configs)
+
+def kept_component_ids(catalog, keep):
+    # Kept components that exist in the project, from a listing without bodies
+    return [component['id'] for component in catalog if component['id'] in keep]
+
+def component_config_entries(component_id, configs):
+    # Listing of one component as selection entries, see select_catalog_configs
+    return [dict(config, component_id=component_id) if is_complete_config(config) else (component_id, config['id']) for config in configs]
+
+def get_component_configs(client, component_id):
+    # Every config of one component with bodies and rows, without listing the rest of the project
+    entries = component_config_entries(component_id, list_component_configs(client, component_id))
+    return fill_config_details(entries, get_configuration_details(client, missing_config_keys(entries)))
+
+def get_selected_configs(client, keep=None, selected_configs=None):
+    # Narrow selections skip the bulk listing of every body in the project: selected configs are fetched directly and
+    # kept components are listed one by one. Full-project and Skip reads go through the catalog.
+    if selected_configs:
+        return get_configuration_details(client, [(config[0], config[2]) for config in selected_configs])
+    component_ids = kept_component_ids(load_component_catalog(client, include=None), keep)
+    if not component_ids:
+        return []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(DETAIL_WORKERS, len(component_ids))) as executor:
+        return [config for configs in executor.map(lambda component_id: get_component_configs(client, component_id), component_ids) for config in configs]
+
+def iter_keboola_configs(client, skip=None, keep=None, selected_configs=None, report=None):
+    # Streaming counterpart of get_keboola_configs: configs are listed one component at a time and yielded as they are read,
+    # so only the current component is held in memory. Components are read in stream_order.
+    report = report or (lambda message: None)
+    if selected_configs:
+        selected = collections.defaultdict(set)
+        for config in selected_configs:
+            selected[config[0]].add(config[2])
+        component_ids = list(selected)
     else:
-        components_src = requests.get(f'{BASE}v2/storage/components', headers=HEAD)
-        for component in components_src.json():
-            component_id = component['id'] 
-            configs = requests.get(f'{BASE}v2/storage/components/{component_id}/configs', headers=HEAD)
-            for config in configs.json():
-                configs_src.append([component_id, config['name'], config['id']])
+        component_ids = []
+        for component in load_component_catalog(client, include=None):
+            component_id = component['id']
+            if skip and component_id in skip:
+                report(f'Component {component_id} is skipped...')
+                continue
+            if keep and component_id not in keep:
+                continue
+            component_ids.append(component_id)
+
+    for component_id in sorted(component_ids, key=stream_order):
+        incomplete = []
+        for config in list_component_configs(client, component_id):
+            if selected_configs and config['id'] not in selected[component_id]:
+                continue
+            if is_complete_config(config):
+                yield dict(config, component_id=component_id)
+            else:
+                incomplete.append((component_id, config['id']))
+        yield from get_configuration_details(client, incomplete)
+
+def list_component_ids(catalog):
+    return list({component['id'] for component in catalog})
+
+def get_component_ids(client):
+    return list_component_ids(load_component_catalog(client, include=None))
+
+def list_component_configurations(catalog, COMPONENT_IDS=None, MODE=None):
+    configs_src = []
+    for component in catalog:
+        component_id = component['id']
+        if COMPONENT_IDS and len(COMPONENT_IDS) > 0:
+            if MODE == 'keep' and component_id not in COMPONENT_IDS:
+                continue
+            if MODE == 'skip' and component_id in COMPONENT_IDS:
+                continue
+        for config in component.get('configurations', []):
+            configs_src.append([component_id, config['name'], config['id']])
     return configs_src
 
-def migrate_config(config, BASE, HEAD, HEAD_DEST, HEAD_FORM_DEST, BRANCH_DEST, source_name, destination_name, DEBUG=False):
-    log_messages = []
-    CSV_PATH = 'log.csv'
+def get_component_configurations(client, COMPONENT_IDS=None, MODE=None):
+    # Names and IDs only, so the listing is fetched without configuration bodies
+    return list_component_configurations(load_component_catalog(client, include=None), COMPONENT_IDS, MODE)
+
+def configs_path(BRANCH_DEST, componentId):
+    return f'v2/storage/branch/{BRANCH_DEST}/components/{componentId}/configs'
+
+def rows_path(BRANCH_DEST, componentId, configurationId):
+    return f'{configs_path(BRANCH_DEST, componentId)}/{configurationId}/rows'
+
+def metadata_path(BRANCH_DEST, componentId, configurationId):
+    return f'{configs_path(BRANCH_DEST, componentId)}/{configurationId}/metadata'
+
+def check_updated(response, what):
+    if response.status_code != 200:
+        raise Exception(f'Failed to update {what}: {response.text}')
+    return 'updated'
+
+def write_config(dest_client, BRANCH_DEST, componentId, configurationId, values, state=None, trace=None):
+    # state comes from the destination index: exactly one create or update call. Without an index, or when a retried
+    # create finds the config already there, the create falls back to an update, which makes the call safe to retry.
+    if state != 'updated':
+        response = dest_client.post(configs_path(BRANCH_DEST, componentId), json=values, retry=True, trace=trace)
+        if response.status_code == 201:
+            return 'created'
+
+    return check_updated(dest_client.put(f'{configs_path(BRANCH_DEST, componentId)}/{configurationId}', json=values, trace=trace), 'config')
+
+def config_values(config):
+    values = {
+        'configurationId': config['id'],
+        'name': config['name'],
+        'configuration': config['configuration']
+    }
+    if config['description']:
+        values['description'] = config['description']
+    return values
+
+def row_values(row):
+    values_row = {
+        'rowId': row['id'],
+        'name': row['name'],
+        'configuration': row['configuration']
+    }
+    if row['description']:
+        values_row['description'] = row['description']
+    return values_row
+
+def write_row(dest_client, BRANCH_DEST, componentId, configurationId, row, state=None, trace=None, on_row_done=None):
+    rowId = row['id']
+    values_row = row_values(row)
+
+    result = None
+    if state != 'updated':
+        response = dest_client.post(rows_path(BRANCH_DEST, componentId, configurationId), json=values_row, retry=True, trace=trace)
+        if response.status_code == 201:
+            result = 'created'
+
+    if result is None:
+        result = check_updated(dest_client.put(f'{rows_path(BRANCH_DEST, componentId, configurationId)}/{rowId}', json=values_row, trace=trace),
+                               f'row {rowId}')
+
+    if on_row_done:
+        on_row_done(row)
+    return result
+
+def collect_row_results(results):
+    # Row states, or one error naming every row that failed
+    errors = [str(result) for result in results if isinstance(result, Exception)]
+    if errors:
+        raise Exception('; '.join(errors))
+    return results
+
+def write_rows(dest_client, BRANCH_DEST, componentId, configurationId, rows_to_write, trace=None, on_row_done=None):
+    # Rows of one config are independent of each other, so they are written concurrently
+    if len(rows_to_write) <= 1:
+        return [write_row(dest_client, BRANCH_DEST, componentId, configurationId, row, state, trace, on_row_done) for row, state in rows_to_write]
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(ROW_WORKERS, len(rows_to_write))) as executor:
+        futures = [executor.submit(write_row, dest_client, BRANCH_DEST, componentId, configurationId, row, state, trace, on_row_done)
+                   for row, state in rows_to_write]
+        concurrent.futures.wait(futures)
+
+    return collect_row_results([future.exception() or future.result() for future in futures])
+
+def journal_config(journal, config, source_name, destination_name, status, log_message, started, trace):
+    if journal is None:
+        return
+    journal.record(ComponentId=config.get('component_id'), SourceProject=source_name, DestinationProject=destination_name,
+                   ConfigurationId=config.get('id'), ConfigurationName=config.get('name'),
+                   DateTime=datetime.datetime.now().replace(microsecond=0), Status=status, StatusText=log_message,
+                   DurationMs=int((time.monotonic() - started) * 1000), Requests=trace.requests, HttpStatus=trace.http_status or '',
+                   BytesSent=trace.bytes_sent, BytesReceived=trace.bytes_received)
+
+def plan_config_writes(config, index=None, incremental=False, checkpoint=None):
+    # Decides what a migration of this config writes: the config state and the rows with their states.
+    # Shared by migrate_config and the dry-run planner so both always agree.
+    counts = collections.Counter()
+    componentId = config['component_id']
+    configurationId = config['id']
+
+    config_state = index.config_state(componentId, config) if index else None
+    if config_state == 'unchanged' and not incremental:
+        config_state = 'updated'
+
+    rows_to_write = []
+    for row in config['rows']:
+        if checkpoint and checkpoint.is_done(componentId, configurationId, row['id']):
+            counts['rows_resumed'] += 1
+            continue
+        row_state = index.row_state(componentId, configurationId, row) if index else None
+        if row_state == 'unchanged' and incremental:
+            counts['rows_unchanged'] += 1
+            continue
+        if row_state == 'unchanged':
+            row_state = 'updated'
+        rows_to_write.append((row, row_state))
+
+    return config_state, rows_to_write, counts
+
+def row_checkpoint(checkpoint, config):
+    # on_row_done callback recording each written row, None without a checkpoint
+    if checkpoint is None:
+        return None
+    return lambda row: checkpoint.mark(config['component_id'], config['id'], row['id'])
+
+def failed_result(config, error):
+    # migrate_config result of a config that raised
+    return (False, [f'FAILED: {config["component_id"]} {config["name"]} {str(error)}'], collections.Counter())
+
+def config_outcome(config, status, source_name, destination_name, started, trace, journal=None, checkpoint=None, counts=None, error=None):
+    # Result of migrate_config for both engines: the log message, the journal record and, unless it failed, the config checkpoint.
+    # status is 'Unchanged', 'Success' or 'Failed'.
+    current_time = datetime.datetime.now().replace(microsecond=0)
+    if status == 'Failed':
+        log_message = f'FAILED: {config["component_id"]} {config["name"]} {str(error)}'
+    else:
+        log_message = f"**{'Unchanged' if status == 'Unchanged' else 'Migrated'}**: {config['component_id']} **{config['name']}** at {current_time}"
+        if checkpoint:
+            checkpoint.mark(config['component_id'], config['id'])
+    journal_config(journal, config, source_name, destination_name, status, log_message, started, trace)
+    return (status != 'Failed', [log_message], counts if status != 'Failed' else collections.Counter())
+
+def dependency_failed(config, failed_dependencies, source_name, destination_name, journal=None):
+    # Result of a config that is never started because something it references did not land. It is journaled as Failed,
+    # so reruns of failed configs pick it up together with its dependency.
+    names = ', '.join('/'.join(dependency) for dependency in sorted(failed_dependencies))
+    return config_outcome(config, 'Failed', source_name, destination_name, time.monotonic(), RequestTrace(), journal,
+                          error=f'not migrated, dependency failed: {names}')
+
+def migrate_config(config, dest_client, BRANCH_DEST, source_name, destination_name, index=None, incremental=False, journal=None,
+                   checkpoint=None, metadata=None):
+    # The destination index decides between create and update for every config and row.
+    # In incremental mode, configs and rows whose content already matches the destination are not written at all.
+    # The checkpoint scope records completed rows and configs, and on resume skips rows an earlier attempt finished.
+    # metadata holds the config's prefetched metadata items, written right after the config itself.
+    started = time.monotonic()
+    trace = RequestTrace()
     try:
         configurationId = config['id']
-        configurationName = config['name']
-        configurationConfig = config['configuration']
         componentId = config['component_id']
-        configurationDescription = config['description']
-
-        values = {
-            'configurationId': configurationId,
-            'name': configurationName,
-            'configuration': configurationConfig
-        }
-        if configurationDescription:
-            values['description'] = configurationDescription
-
-        metadataFolderPayload = False
-        if componentId == 'keboola.snowflake-transformation':
-            snowflake_metadata = requests.get(f'{BASE}v2/storage/branch/{BRANCH_DEST}/components/keboola.snowflake-transformation/configs/{configurationId}/metadata',
-                                              headers=HEAD)
-            if snowflake_metadata.json():
-                metadataFolderPayload = {
-                    "metadata[0][key]": "KBC.configuration.folderName",
-                    "metadata[0][value]": snowflake_metadata.json()[0]['value']
-                }
-
-        metadataFolderPayloadPython = False
-        if componentId == 'keboola.python-transformation-v2':
-            python_metadata = requests.get(f'{BASE}v2/storage/branch/{BRANCH_DEST}/components/keboola.python-transformation-v2/configs/{configurationId}/metadata',
-                                              headers=HEAD)
-            if python_metadata.json():
-                metadataFolderPayloadPython = {
-                    "metadata[0][key]": "KBC.configuration.folderName",
-                    "metadata[0][value]": python_metadata.json()[0]['value']
-                }
-
-        if not DEBUG:
-            config_dest = requests.post(f'{BASE}v2/storage/branch/{BRANCH_DEST}/components/{componentId}/configs',
-                                        headers=HEAD_DEST,
-                                        json=values)
-            if config_dest.status_code != 201:
-                response = requests.put(f'{BASE}v2/storage/branch/{BRANCH_DEST}/components/{componentId}/configs/{configurationId}',
-                                                  headers=HEAD_DEST,
-                                                  json=values)
-                if response.status_code != 200:
-                    raise Exception(f'Failed to update config: {response.text}')
-
-            if metadataFolderPayload:
-                requests.post(f'{BASE}v2/storage/branch/{BRANCH_DEST}/components/keboola.snowflake-transformation/configs/{configurationId}/metadata',
-                              headers=HEAD_FORM_DEST,
-                              data=metadataFolderPayload)
-
-            if metadataFolderPayloadPython:
-                requests.post(f'{BASE}v2/storage/branch/{BRANCH_DEST}/components/keboola.python-transformation-v2/configs/{configurationId}/metadata',
-                              headers=HEAD_FORM_DEST,
-                              data=metadataFolderPayloadPython)
-
-            current_time = datetime.datetime.now().replace(microsecond=0)
-            log_message = f"**Migrated**: {config['component_id']} **{config['name']}** at {current_time}"
-            log_messages.append(log_message)
-
-        with open(CSV_PATH, mode='a', newline='') as file:
-            writer = csv.writer(file)
-            writer.writerow([config['component_id'], source_name, destination_name, config['id'], config['name'], current_time, 'Success', log_message])
-
-
-        for row in config['rows']:
-                rowId = row['id']
-                rowName = row['name']
-                rowConfig = row['configuration']
-                rowDescription = row['description']
-                values_row = {
-                    'rowId': rowId,
-                    'name': rowName,
-                    'configuration': rowConfig
-                }
-                if rowDescription:
-                    values_row['description'] = rowDescription
-                
-                if not DEBUG:
-                    config_dest_row = requests.post(f'{BASE}v2/storage/branch/{BRANCH_DEST}/components/{componentId}/configs/{configurationId}/rows/{rowId}',
-                                                    headers=HEAD_DEST,
-                                                    json=values_row)
-                    config_dest_row_update = requests.put(f'{BASE}v2/storage/branch/{BRANCH_DEST}/components/{componentId}/configs/{configurationId}/rows/{rowId}',
-                                                    headers=HEAD_DEST,
-                                                    json=values_row)
-                #log_messages.append(config_dest_row_update.json())
+        values = config_values(config)
+
+        config_state, rows_to_write, counts = plan_config_writes(config, index, incremental, checkpoint)
 
+        if config_state == 'unchanged' and not rows_to_write:
+            counts['configs_unchanged'] += 1
+            return config_outcome(config, 'Unchanged', source_name, destination_name, started, trace, journal, checkpoint, counts)
 
+        if config_state != 'unchanged':
+            counts[f'configs_{write_config(dest_client, BRANCH_DEST, componentId, configurationId, values, config_state, trace)}'] += 1
+            # All prefetched metadata keys of the config in one call
+            if metadata:
+                dest_client.post(metadata_path(BRANCH_DEST, componentId, configurationId), data=metadata_payload(metadata), retry=True, trace=trace)
+        else:
+            counts['configs_unchanged'] += 1
 
+        for row_state in write_rows(dest_client, BRANCH_DEST, componentId, configurationId, rows_to_write, trace, row_checkpoint(checkpoint, config)):
+            counts[f'rows_{row_state}'] += 1
+        return config_outcome(config, 'Success', source_name, destination_name, started, trace, journal, checkpoint, counts)
 
     except Exception as e:
-        current_time = datetime.datetime.now().replace(microsecond=0)
-        log_message = f'FAILED: {config["component_id"]} {config["name"]} {str(e)}'
-        log_messages.append(log_message)
-
-        with open(CSV_PATH, mode='a', newline='') as file:
-            writer = csv.writer(file)
-            writer.writerow([config['component_id'], source_name, destination_name, config['id'], config['name'], current_time, 'Failed', log_message])
-
-        return (False, log_messages)
-    
-    return (True, log_messages)
-
-def migrate_configs(BASE, HEAD, configs_src, HEAD_DEST, HEAD_FORM_DEST, BRANCH_DEST, source_name, destination_name, DEBUG=False):
-    fails = []
-    log_messages = []
-    
-    st.write(f'Proceeding to migrate {len(configs_src)} configurations...')
-
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        futures = {executor.submit(migrate_config, config, BASE, HEAD, HEAD_DEST, HEAD_FORM_DEST, BRANCH_DEST, source_name, destination_name, DEBUG): config for config in configs_src}
-
-        for future in concurrent.futures.as_completed(futures):
-            config = futures[future]
-            try:
-                success, messages = future.result()
-                log_messages.extend(messages)
-                if not success:
-                    fails.append(config)
-            except Exception as exc:
-                log_messages.append(f'FAILED: {config["component_id"]} {config["name"]} {str(exc)}')
-                fails.append(config)
-
-    for message in log_messages:
-        st.write(message)
-
-    return fails
\ No newline at end of file
+        return config_outcome(config, 'Failed', source_name, destination_name, started, trace, journal, error=e)
+
+class ConfigSchedule:
+    # Ready-queue over a DependencyGraph, shared by every engine: a config starts as soon as everything it references
+    # (variables, shared code, flow and scheduler targets) has landed, so there is no barrier between unrelated configs.
+    # A config whose dependency failed is never started; it fails too, and so do its own dependents.
+    # The engines only submit the keys returned by start, release_cycles and record, and pass each result back to record.
+
+    def __init__(self, configs_src, on_progress=None, counts=None, journal=None, source_name=None, destination_name=None):
+        graph = DependencyGraph(configs_src)
+        self.configs = graph.configs
+        self.dependencies = graph.dependencies
+        self.dependents = graph.dependents
+        self.pending = {key: len(dependencies) for key, dependencies in self.dependencies.items()}
+        self.failed = set()
+        self.fails = []
+        # Messages of every finished config, reported once the schedule is done; None when on_progress is enough
+        self.log_messages = []
+        self.on_progress = on_progress
+        self.counts = counts
+        self.journal = journal
+        self.source_name = source_name
+        self.destination_name = destination_name
+
+    def __len__(self):
+        return len(self.configs)
+
+    def config(self, key):
+        return self.configs[key]
+
+    def start(self):
+        ready = [key for key, count in self.pending.items() if count == 0]
+        for key in ready:
+            del self.pending[key]
+        return ready
+
+    def release_cycles(self):
+        # Only dependency cycles are left when nothing is running, they go all at once
+        ready = list(self.pending)
+        self.pending.clear()
+        return ready
+
+    def record(self, key, result):
+        # result of migrate_config; returns the configs that became ready
+        success, messages, config_counts = result
+        if self.counts is not None and config_counts:
+            self.counts.update(config_counts)
+        self._finish(key, success, messages)
+        return self._release(key)
+
+    def _release(self, key):
+        # Dependents waiting for nothing else once key is done; those with a failed dependency fail in turn
+        ready = []
+        released = [key]
+        while released:
+            for dependent in self.dependents.pop(released.pop(), ()):
+                if dependent not in self.pending:
+                    continue
+                self.pending[dependent] -= 1
+                if self.pending[dependent] > 0:
+                    continue
+                del self.pending[dependent]
+                failed_dependencies = self.dependencies[dependent] & self.failed
+                if not failed_dependencies:
+                    ready.append(dependent)
+                    continue
+                # Never land a config whose dependency did not land
+                success, messages, _ = dependency_failed(self.config(dependent), failed_dependencies, self.source_name, self.destination_name, self.journal)
+                self._finish(dependent, success, messages)
+                released.append(dependent)
+        return ready
+
+    def _finish(self, key, success, messages):
+        config = self.config(key)
+        if self.log_messages is not None:
+            self.log_messages.extend(messages)
+        if not success:
+            self.fails.append(config)
+            self.failed.add(key)
+        get_metrics().record_config(success)
+        if self.on_progress:
+            self.on_progress(config, success, messages)
+
+def migrate_configs(configs_src, dest_client, BRANCH_DEST, source_name, destination_name, report=None, on_progress=None,
+                    index=None, counts=None, incremental=False, journal=None, checkpoint=None, metadata=None):
+    # report receives the text messages, on_progress(config, success, messages) fires as each config finishes.
+    # counts, when given, collects unchanged/created/updated totals for configs and rows.
+    # metadata maps metadata_key(component_id, config_id) to the prefetched metadata items.
+    # Without a journal shared by the whole run, one is opened just for these configs.
+    if journal is None:
+        with RunJournal() as journal:
+            return migrate_configs(configs_src, dest_client, BRANCH_DEST, source_name, destination_name, report, on_progress,
+                                   index, counts, incremental, journal, checkpoint, metadata)
+
+    report = report or (lambda message: None)
+    metadata = metadata or {}
+    schedule = ConfigSchedule(configs_src, on_progress, counts, journal, source_name, destination_name)
+
+    report(f'Proceeding to migrate {len(schedule)} configurations...')
+
+    # One worker per pooled destination connection
+    with concurrent.futures.ThreadPoolExecutor(max_workers=dest_client.pool_size) as executor:
+        futures = {}
+
+        def submit(keys):
+            for key in keys:
+                config = schedule.config(key)
+                future = executor.submit(migrate_config, config, dest_client, BRANCH_DEST, source_name, destination_name, index, incremental, journal,
+                                         checkpoint, metadata.get(metadata_key(config['component_id'], config['id'])))
+                futures[future] = key
+
+        submit(schedule.start())
+        while futures or schedule.pending:
+            if not futures:
+                submit(schedule.release_cycles())
+
+            done, _ = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                key = futures.pop(future)
+                try:
+                    result = future.result()
+                except Exception as exc:
+                    result = failed_result(schedule.config(key), exc)
+                submit(schedule.record(key, result))
+
+    for message in schedule.log_messages:
+        report(message)
+
+    return schedule.fails
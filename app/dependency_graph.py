@@ -0,0 +1,88 @@
+import collections
+
+VARIABLES_COMPONENT = 'keboola.variables'
+SHARED_CODE_COMPONENT = 'keboola.shared-code'
+ORCHESTRATOR_COMPONENTS = ('keboola.orchestrator', 'keboola.flow')
+SCHEDULER_COMPONENT = 'keboola.scheduler'
+
+
+def stream_order(component_id):
+    # Reading order of a streamed source: referenced components first, flows and schedulers last
+    if component_id in (VARIABLES_COMPONENT, SHARED_CODE_COMPONENT):
+        return 0
+    if component_id in ORCHESTRATOR_COMPONENTS:
+        return 2
+    if component_id == SCHEDULER_COMPONENT:
+        return 3
+    return 1
+
+
+def config_key(config):
+    return (config['component_id'], str(config['id']))
+
+
+def config_references(config):
+    # Configurations this one points to: its variables, its shared code, flow tasks and the scheduler target
+    configuration = config.get('configuration') or {}
+    references = set()
+    if configuration.get('variables_id'):
+        references.add((VARIABLES_COMPONENT, str(configuration['variables_id'])))
+    if configuration.get('shared_code_id'):
+        references.add((SHARED_CODE_COMPONENT, str(configuration['shared_code_id'])))
+
+    if config['component_id'] in ORCHESTRATOR_COMPONENTS:
+        for task in configuration.get('tasks') or []:
+            target = task.get('task') or {}
+            if target.get('componentId') and target.get('configId'):
+                references.add((target['componentId'], str(target['configId'])))
+
+    if config['component_id'] == SCHEDULER_COMPONENT:
+        target = configuration.get('target') or {}
+        if target.get('componentId') and target.get('configurationId'):
+            references.add((target['componentId'], str(target['configurationId'])))
+    return references
+
+
+def index_variables_by_config(variables_options):
+    # Variables configurations are named "Variables definition for <component_id>/<config_id>"
+    variables_by_config = collections.defaultdict(list)
+    for variable in variables_options:
+        variables_by_config[variable[1].rsplit('/', 1)[-1]].append(variable)
+    return variables_by_config
+
+
+class DependencyGraph:
+    # Dependencies between the configurations of one migration; references outside the migrated set are ignored
+
+    def __init__(self, configs):
+        self.configs = {}
+        for config in configs:
+            self.configs.setdefault(config_key(config), config)
+
+        self.dependencies = {key: config_references(config) & self.configs.keys() - {key} for key, config in self.configs.items()}
+        self.dependents = collections.defaultdict(set)
+        for key, dependencies in self.dependencies.items():
+            for dependency in dependencies:
+                self.dependents[dependency].add(key)
+
+    def __len__(self):
+        return len(self.configs)
+
+    def waves(self):
+        # Topological levels: each wave only depends on earlier ones. Members of a cycle end up together in the last wave.
+        pending = {key: len(dependencies) for key, dependencies in self.dependencies.items()}
+        wave = [key for key, count in pending.items() if count == 0]
+        waves = []
+        while wave:
+            waves.append(wave)
+            next_wave = []
+            for key in wave:
+                del pending[key]
+                for dependent in self.dependents[key]:
+                    pending[dependent] -= 1
+                    if pending[dependent] == 0:
+                        next_wave.append(dependent)
+            wave = next_wave
+        if pending:
+            waves.append(list(pending))
+        return waves
@@ -0,0 +1,59 @@
+import hashlib
+from json_codec import dumps, response_json
+
+DESTINATION_INCLUDE = 'configuration,rows'
+
+
+def content_hash(item):
+    # Hash of the fields a migration writes, for both configurations and rows
+    payload = dumps({
+        'name': item.get('name') or '',
+        'description': item.get('description') or '',
+        'configuration': item.get('configuration') or {},
+    }, sort_keys=True)
+    return hashlib.sha256(payload).hexdigest()
+
+
+class DestinationIndex:
+    # Content hashes of the configurations and rows already present in a destination branch
+
+    def __init__(self, config_hashes=None, row_hashes=None):
+        self.config_hashes = config_hashes or {}
+        self.row_hashes = row_hashes or {}
+
+    def has_config(self, component_id, config_id):
+        return (component_id, config_id) in self.config_hashes
+
+    def has_row(self, component_id, config_id, row_id):
+        return (component_id, config_id, row_id) in self.row_hashes
+
+    def config_state(self, component_id, config):
+        current = self.config_hashes.get((component_id, config['id']))
+        if current is None:
+            return 'created'
+        return 'unchanged' if current == content_hash(config) else 'updated'
+
+    def row_state(self, component_id, config_id, row):
+        current = self.row_hashes.get((component_id, config_id, row['id']))
+        if current is None:
+            return 'created'
+        return 'unchanged' if current == content_hash(row) else 'updated'
+
+
+def load_destination_index(dest_client, BRANCH_DEST):
+    # Whole destination branch in a single bulk listing
+    components = dest_client.get(f'v2/storage/branch/{BRANCH_DEST}/components', params={'include': DESTINATION_INCLUDE})
+    components.raise_for_status()
+    return build_destination_index(response_json(components))
+
+
+def build_destination_index(components):
+    config_hashes = {}
+    row_hashes = {}
+    for component in components:
+        component_id = component['id']
+        for config in component.get('configurations', []):
+            config_hashes[(component_id, config['id'])] = content_hash(config)
+            for row in config.get('rows', []):
+                row_hashes[(component_id, config['id'], row['id'])] = content_hash(row)
+    return DestinationIndex(config_hashes, row_hashes)
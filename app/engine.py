@@ -0,0 +1,57 @@
+import json
+from config_migrator import load_component_catalog, get_catalog_configs, get_component_configs, get_selected_configs, SHARED_CODE_COMPONENT
+from fanout import migrate_destinations as migrate_destinations_threads
+from metadata import prefetch_metadata
+from source_snapshot import build_source_snapshot
+
+# Migration engine shared by the Streamlit page and the command line. Nothing here imports Streamlit;
+# progress is reported through plain callables (report for text, on_event for the fan-out events).
+
+# threads: a worker thread per in-flight config (fanout). asyncio: coroutines on one event loop (async_engine, needs aiohttp).
+ENGINES = ('threads', 'asyncio')
+
+
+def load_projects(config_path):
+    with open(config_path, 'r') as file:
+        return json.load(file)['projects']
+
+
+def find_projects(projects, names):
+    by_name = {project['name']: project for project in projects}
+    missing = [name for name in names if name not in by_name]
+    if missing:
+        raise ValueError(f"Unknown projects: {', '.join(missing)}")
+    return [by_name[name] for name in names]
+
+
+def load_shared_code_configs(source_client, catalog=None):
+    # Picked from an already loaded catalog; otherwise only the shared-code component is listed, never the whole project
+    if catalog is None:
+        return get_component_configs(source_client, SHARED_CODE_COMPONENT)
+    return get_catalog_configs(source_client, catalog, keep=[SHARED_CODE_COMPONENT])
+
+
+def load_source_snapshot(source_client, source_name, skip=None, keep=None, selected_configs=None, include_shared_code=False, report=None):
+    # A full or Skip read takes one bulk listing, which also serves the shared codes; a Keep or config selection
+    # reads only what it selected. Shared codes are trimmed to the rows the loaded transformations reference.
+    if selected_configs or keep:
+        catalog = None
+        configs = get_selected_configs(source_client, keep, selected_configs)
+    else:
+        catalog = load_component_catalog(source_client)
+        configs = get_catalog_configs(source_client, catalog, skip, keep, selected_configs, report)
+    shared_code_configs = load_shared_code_configs(source_client, catalog) if include_shared_code else []
+    # Metadata of every config is read up front, so destination writes never wait on the source project
+    metadata = prefetch_metadata(source_client, configs + shared_code_configs)
+    return build_source_snapshot(source_name, source_client.url, configs, shared_code_configs, metadata)
+
+
+def get_migrate_destinations(engine='threads'):
+    # migrate_destinations of the selected engine; both take the same arguments and return the same summaries
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine: {engine}, expected one of {', '.join(ENGINES)}")
+    if engine == 'asyncio':
+        # Imported on demand, so starting the thread engine never loads the asyncio one
+        from async_engine import migrate_destinations as migrate_destinations_asyncio
+        return migrate_destinations_asyncio
+    return migrate_destinations_threads
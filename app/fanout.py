@@ -0,0 +1,103 @@
+import collections
+import concurrent.futures
+import contextlib
+import threading
+from requests.exceptions import ConnectionError, Timeout
+from checkpoint import CheckpointStore, CHECKPOINT_PATH
+from config_migrator import migrate_configs
+from destination_index import load_destination_index
+from history import HistoryStore, HISTORY_PATH
+from journal import RunJournal
+from keboola_client import get_client
+
+DEFAULT_MAX_DESTINATIONS = 4
+# In-flight Storage API requests across the whole run and per destination project
+DEFAULT_GLOBAL_IN_FLIGHT = 64
+DEFAULT_DESTINATION_IN_FLIGHT = 16
+
+
+def destination_summary(destination_name, total=0, resumed=0, error=None):
+    # Summary of one destination as returned by either engine's migrate_destinations
+    return {'destination': destination_name, 'total': total, 'migrated': 0, 'failed': 0, 'fails': [], 'error': error,
+            'connection_error': False, 'counts': collections.Counter(), 'resumed': resumed}
+
+
+def planned_configs(snapshot, checkpoint=None):
+    # Shared codes and configs still to migrate; on resume only the configs without a completed checkpoint are planned again
+    shared_code_configs = [config for config in snapshot.shared_code_configs if not checkpoint or not checkpoint.is_done(config['component_id'], config['id'])]
+    configs = [config for config in snapshot.configs if not checkpoint or not checkpoint.is_done(config['component_id'], config['id'])]
+    resumed = len(snapshot.shared_code_configs) + len(snapshot.configs) - len(shared_code_configs) - len(configs)
+    return shared_code_configs + configs, resumed
+
+
+def migrate_destination(snapshot, dest_project, BRANCH_DEST, global_limit, destination_in_flight, on_event, incremental=False, journal=None,
+                        checkpoint=None):
+    destination_name = dest_project['name']
+    dest_client = get_client(dest_project['url'], dest_project['token'])
+    dest_client.set_limits(destination_in_flight, global_limit)
+
+    configs, resumed = planned_configs(snapshot, checkpoint)
+    total = len(configs)
+    summary = destination_summary(destination_name, total, resumed)
+    lock = threading.Lock()
+
+    def report(message):
+        on_event({'type': 'message', 'destination': destination_name, 'message': message})
+
+    def progress(config, success, messages):
+        with lock:
+            summary['migrated' if success else 'failed'] += 1
+            done = summary['migrated'] + summary['failed']
+        on_event({'type': 'config_done', 'destination': destination_name, 'config': config, 'success': success,
+                  'messages': messages, 'done': done, 'total': total})
+
+    on_event({'type': 'destination_started', 'destination': destination_name, 'total': total, 'resumed': resumed})
+    try:
+        # Existence index of the destination branch: one create-or-update call per object, and content hashes for incremental runs
+        index = load_destination_index(dest_client, BRANCH_DEST)
+
+        # Shared codes, variables and flow targets are written before the configs referencing them, see DependencyGraph
+        summary['fails'].extend(migrate_configs(configs, dest_client, BRANCH_DEST, snapshot.source_name, destination_name,
+                                                report=report, on_progress=progress, index=index, counts=summary['counts'], incremental=incremental, journal=journal,
+                                                checkpoint=checkpoint, metadata=snapshot.metadata))
+    except Exception as e:
+        summary['error'] = str(e)
+        summary['connection_error'] = isinstance(e, (ConnectionError, Timeout))
+
+    on_event(dict(summary, type='destination_finished'))
+    return summary
+
+
+def migrate_destinations(snapshot, destinations, BRANCH_DEST='default', max_destinations=DEFAULT_MAX_DESTINATIONS,
+                         global_in_flight=DEFAULT_GLOBAL_IN_FLIGHT, destination_in_flight=DEFAULT_DESTINATION_IN_FLIGHT, on_event=None, incremental=False,
+                         jsonl_path=None, run_id=None, resume=False, checkpoint_path=CHECKPOINT_PATH,
+                         history_path=HISTORY_PATH):
+    # Migrates several destination projects at once and returns a summary per destination name.
+    # on_event is called from worker threads, so UI callers should hand the events over to their own thread.
+    # With a run_id, completed configs and rows are checkpointed; resume=True continues that run instead of starting it over.
+    on_event = on_event or (lambda event: None)
+    # Only destinations are contacted: configs and their metadata come from the snapshot
+    global_limit = threading.BoundedSemaphore(global_in_flight)
+
+    checkpoints = CheckpointStore(checkpoint_path) if run_id else None
+    if checkpoints and not resume:
+        checkpoints.reset(run_id)
+
+    summaries = {}
+    # One journal writer and one checkpoint writer for every destination of the run
+    history = HistoryStore(history_path) if history_path else None
+    with RunJournal(jsonl_path=jsonl_path, history=history, run_id=run_id) as journal, checkpoints or contextlib.nullcontext(), \
+            concurrent.futures.ThreadPoolExecutor(max_workers=max(1, max_destinations)) as executor:
+        futures = {executor.submit(migrate_destination, snapshot, dest_project, BRANCH_DEST, global_limit, destination_in_flight, on_event,
+                                   incremental, journal,
+                                   checkpoints.scope(run_id, snapshot.source_name, dest_project['name'], resume) if checkpoints else None): dest_project
+                   for dest_project in destinations}
+
+        for future in concurrent.futures.as_completed(futures):
+            dest_project = futures[future]
+            try:
+                summaries[dest_project['name']] = future.result()
+            except Exception as exc:
+                summaries[dest_project['name']] = destination_summary(dest_project['name'], error=str(exc))
+
+    return summaries
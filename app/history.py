@@ -0,0 +1,270 @@
+import contextlib
+import csv
+import datetime
+import itertools
+import os
+import sqlite3
+from journal import CSV_PATH, upgrade_csv_header
+
+HISTORY_PATH = 'history.db'
+IMPORT_BATCH_SIZE = 5000
+# log.csv rows were written with both of these before the journal settled on ISO timestamps
+LEGACY_DATE_FORMATS = ('%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S', '%d/%m/%Y %H:%M', '%d/%m/%Y %H:%M:%S')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_id TEXT,
+    kind TEXT NOT NULL,
+    started_at TEXT NOT NULL,
+    finished_at TEXT,
+    configs INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS migrations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run INTEGER NOT NULL REFERENCES runs (id),
+    source_project TEXT,
+    destination_project TEXT,
+    component_id TEXT,
+    config_id TEXT,
+    config_name TEXT,
+    migrated_at TEXT,
+    status TEXT,
+    status_text TEXT,
+    duration_ms INTEGER,
+    requests INTEGER,
+    http_status INTEGER,
+    bytes_sent INTEGER,
+    bytes_received INTEGER
+);
+CREATE INDEX IF NOT EXISTS migrations_config ON migrations (component_id, config_id, destination_project, migrated_at);
+CREATE INDEX IF NOT EXISTS migrations_destination ON migrations (destination_project, migrated_at);
+CREATE INDEX IF NOT EXISTS migrations_source ON migrations (source_project, migrated_at);
+CREATE INDEX IF NOT EXISTS migrations_status ON migrations (status, migrated_at);
+CREATE INDEX IF NOT EXISTS migrations_run ON migrations (run, status);
+CREATE INDEX IF NOT EXISTS migrations_time ON migrations (migrated_at);
+-- How much of each CSV log is already in the store: imports seek to byte_offset and only parse what was appended since
+CREATE TABLE IF NOT EXISTS imports (
+    csv_path TEXT PRIMARY KEY,
+    records INTEGER NOT NULL,
+    byte_offset INTEGER
+);
+'''
+
+COLUMNS = ('run', 'source_project', 'destination_project', 'component_id', 'config_id', 'config_name', 'migrated_at', 'status', 'status_text',
+           'duration_ms', 'requests', 'http_status', 'bytes_sent', 'bytes_received')
+# Journal record field for every column after run
+JOURNAL_FIELDS = ('SourceProject', 'DestinationProject', 'ComponentId', 'ConfigurationId', 'ConfigurationName', 'DateTime', 'Status', 'StatusText',
+                  'DurationMs', 'Requests', 'HttpStatus', 'BytesSent', 'BytesReceived')
+
+
+def now():
+    return datetime.datetime.now().replace(microsecond=0).isoformat(sep=' ')
+
+
+def normalize_datetime(value):
+    if isinstance(value, datetime.datetime):
+        return value.replace(microsecond=0).isoformat(sep=' ')
+    value = (value or '').strip()
+    for date_format in LEGACY_DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, date_format).isoformat(sep=' ')
+        except ValueError:
+            continue
+    return value or None
+
+
+def to_int(value):
+    try:
+        return int(value) if value not in (None, '') else None
+    except (TypeError, ValueError):
+        return None
+
+
+def history_row(run, record):
+    values = [record.get(field) for field in JOURNAL_FIELDS]
+    values[5] = normalize_datetime(values[5])
+    values[8:] = [to_int(value) for value in values[8:]]
+    return (run, *values)
+
+
+def is_valid_record(record):
+    # Multi-line status texts broke some legacy rows into fragments without a status
+    return bool(record.get('Status') and record.get('DestinationProject') and record.get('ComponentId'))
+
+
+class HistoryStore:
+    # Indexed copy of the migration journal. The journal writer feeds it; existing log.csv files are imported.
+    # Every call opens its own connection, so the store can be shared between the writer thread and the UI.
+
+    def __init__(self, path=HISTORY_PATH):
+        self.path = path
+        with self._connection() as connection:
+            connection.executescript(SCHEMA)
+            # Stores created before imports kept an offset only have the record count
+            if 'byte_offset' not in {row['name'] for row in connection.execute('PRAGMA table_info(imports)')}:
+                connection.execute('ALTER TABLE imports ADD COLUMN byte_offset INTEGER')
+
+    @contextlib.contextmanager
+    def _connection(self):
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.row_factory = sqlite3.Row
+        try:
+            connection.execute('PRAGMA journal_mode=WAL')
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def start_run(self, run_id=None, kind='run'):
+        with self._connection() as connection:
+            return connection.execute('INSERT INTO runs (run_id, kind, started_at) VALUES (?, ?, ?)', (run_id, kind, now())).lastrowid
+
+    def finish_run(self, run):
+        with self._connection() as connection:
+            connection.execute('UPDATE runs SET finished_at = ? WHERE id = ?', (now(), run))
+
+    def record_batch(self, run, records, csv_path=None, csv_offset=None):
+        # Journal records of one batch; csv_path marks them as already imported from that CSV log, which ends at csv_offset
+        with self._connection() as connection:
+            self._insert(connection, run, records)
+            if csv_path:
+                self._advance_import(connection, csv_path, len(records), csv_offset)
+
+    def _insert(self, connection, run, records):
+        rows = [history_row(run, record) for record in records if is_valid_record(record)]
+        connection.executemany(f"INSERT INTO migrations ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})", rows)
+        # Run totals are kept up to date here, so listing runs never counts migrations
+        connection.execute('UPDATE runs SET configs = configs + ?, failed = failed + ? WHERE id = ?',
+                           (len(rows), sum(1 for row in rows if row[COLUMNS.index('status')] == 'Failed'), run))
+
+    def _advance_import(self, connection, csv_path, records, csv_offset):
+        connection.execute('''
+            INSERT INTO imports (csv_path, records, byte_offset) VALUES (?, ?, ?)
+            ON CONFLICT (csv_path) DO UPDATE SET records = records + excluded.records, byte_offset = excluded.byte_offset''',
+                           (os.path.abspath(csv_path), records, csv_offset))
+
+    def import_csv(self, csv_path=CSV_PATH):
+        # Adds the log.csv records not imported yet; returns how many records were read.
+        # Parsing starts at the stored offset, so a run only reads what the log gained since the last import.
+        if not os.path.exists(csv_path):
+            return 0
+        # Offsets are only valid for the current layout, and it is never rewritten once upgraded
+        upgrade_csv_header(csv_path)
+        with self._connection() as connection:
+            row = connection.execute('SELECT records, byte_offset FROM imports WHERE csv_path = ?', (os.path.abspath(csv_path),)).fetchone()
+
+        run = None
+        read = 0
+        with open(csv_path, mode='r', newline='', encoding='utf-8-sig') as file:
+            # Lines are pulled with readline so file.tell() stays usable; a record may span several lines
+            lines = iter(file.readline, '')
+            header = next(csv.reader(lines), None)
+            if header is None:
+                return 0
+            reader = csv.DictReader(lines, fieldnames=header)
+            offset = None
+            if row and row['byte_offset'] is not None:
+                file.seek(row['byte_offset'])
+            elif row:
+                # Older stores counted imported records: skip them once, the offset is kept from then on
+                for _ in itertools.islice(reader, row['records']):
+                    pass
+                offset = file.tell()
+
+            batch = []
+            for record in reader:
+                batch.append(record)
+                if len(batch) >= IMPORT_BATCH_SIZE:
+                    run = run or self.start_run(kind='import')
+                    self.record_batch(run, batch, csv_path, file.tell())
+                    read += len(batch)
+                    batch = []
+                    offset = None
+            if batch:
+                run = run or self.start_run(kind='import')
+                self.record_batch(run, batch, csv_path, file.tell())
+                read += len(batch)
+            elif offset is not None:
+                with self._connection() as connection:
+                    self._advance_import(connection, csv_path, 0, offset)
+        if run:
+            self.finish_run(run)
+        return read
+
+    def query(self, source=None, destination=None, component_id=None, config_id=None, status=None, run=None, since=None, until=None,
+              search=None, limit=1000):
+        # Newest first; every filter is optional and served by an index
+        conditions, parameters = [], []
+        for column, value in (('source_project', source), ('destination_project', destination), ('component_id', component_id),
+                              ('config_id', config_id), ('status', status), ('run', run)):
+            if value:
+                conditions.append(f'{column} = ?')
+                parameters.append(value)
+        if since:
+            conditions.append('migrated_at >= ?')
+            parameters.append(normalize_datetime(since) if not isinstance(since, datetime.date) else str(since))
+        if until:
+            conditions.append('migrated_at < ?')
+            parameters.append(normalize_datetime(until) if not isinstance(until, datetime.date) else str(until))
+        if search:
+            conditions.append('(config_name LIKE ? OR status_text LIKE ?)')
+            parameters += [f'%{search}%', f'%{search}%']
+
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        with self._connection() as connection:
+            rows = connection.execute(f'SELECT * FROM migrations {where} ORDER BY migrated_at DESC, id DESC LIMIT ?', (*parameters, limit)).fetchall()
+        return [dict(row) for row in rows]
+
+    def last_success(self, component_id, config_id, destination):
+        # When the config was last migrated to the destination without failing
+        with self._connection() as connection:
+            row = connection.execute('''
+                SELECT * FROM migrations
+                WHERE component_id = ? AND config_id = ? AND destination_project = ? AND status IN ('Success', 'Unchanged')
+                ORDER BY migrated_at DESC, id DESC LIMIT 1''', (component_id, config_id, destination)).fetchone()
+        return dict(row) if row else None
+
+    def runs(self, limit=50):
+        with self._connection() as connection:
+            rows = connection.execute('SELECT * FROM runs ORDER BY id DESC LIMIT ?', (limit,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def last_run(self, source=None):
+        # Latest migration run, imports of old logs are not runs
+        with self._connection() as connection:
+            if source:
+                row = connection.execute('''
+                    SELECT MAX(run) AS run FROM migrations
+                    WHERE source_project = ? AND run IN (SELECT id FROM runs WHERE kind = 'run')''', (source,)).fetchone()
+            else:
+                row = connection.execute("SELECT MAX(id) AS run FROM runs WHERE kind = 'run'").fetchone()
+        return row['run'] if row else None
+
+    def failed_configs(self, run=None, source=None):
+        # Configs that failed in the given run (the last one by default), one entry per destination
+        run = run or self.last_run(source)
+        if run is None:
+            return []
+        with self._connection() as connection:
+            rows = connection.execute('''
+                SELECT DISTINCT source_project, destination_project, component_id, config_id, config_name
+                FROM migrations WHERE run = ? AND status = 'Failed'
+                ORDER BY destination_project, component_id, config_id''', (run,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def distinct(self, column):
+        # Filter options. Each step jumps to the next key of the column's index, so the cost depends on the number of
+        # distinct values, not on the number of records.
+        if column not in ('source_project', 'destination_project', 'status'):
+            raise ValueError(f'Unsupported column: {column}')
+        with self._connection() as connection:
+            rows = connection.execute(f'''
+                WITH RECURSIVE keys (value) AS (
+                    SELECT MIN({column}) FROM migrations
+                    UNION ALL
+                    SELECT (SELECT MIN({column}) FROM migrations WHERE {column} > keys.value) FROM keys WHERE keys.value IS NOT NULL
+                )
+                SELECT value FROM keys WHERE value IS NOT NULL''').fetchall()
+        return [row[0] for row in rows]
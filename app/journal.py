@@ -0,0 +1,149 @@
+import csv
+import json
+import os
+import queue
+import sqlite3
+import threading
+
+CSV_PATH = 'log.csv'
+LEGACY_COLUMNS = ['ComponentId', 'SourceProject', 'DestinationProject', 'ConfigurationId', 'ConfigurationName', 'DateTime', 'Status', 'StatusText']
+JOURNAL_COLUMNS = LEGACY_COLUMNS + ['DurationMs', 'Requests', 'HttpStatus', 'BytesSent', 'BytesReceived']
+FLUSH_INTERVAL = 1.0
+BATCH_SIZE = 500
+
+
+def upgrade_csv_header(csv_path):
+    # Older log.csv files only have the legacy columns; rewrite them once so every row has the same width.
+    # Only the header is read on every run, the records are streamed through when a rewrite is needed.
+    with open(csv_path, mode='r', newline='', encoding='utf-8-sig') as file:
+        header = next(csv.reader(file), None)
+    if header is None or header == JOURNAL_COLUMNS:
+        return
+
+    width = len(JOURNAL_COLUMNS)
+    temp_path = f'{csv_path}.tmp'
+    with open(csv_path, mode='r', newline='', encoding='utf-8-sig') as source, \
+            open(temp_path, mode='w', newline='', encoding='utf-8') as file:
+        records = csv.reader(source)
+        if header == LEGACY_COLUMNS:
+            next(records)
+        writer = csv.writer(file)
+        writer.writerow(JOURNAL_COLUMNS)
+        for record in records:
+            writer.writerow((record + [''] * width)[:width])
+    os.replace(temp_path, csv_path)
+
+
+class JournalError(Exception):
+    pass
+
+
+class RunJournal:
+    # Single writer for the migration log: workers only enqueue records, one thread batches them into CSV (and JSONL),
+    # and into the history store when one is given
+
+    def __init__(self, csv_path=CSV_PATH, jsonl_path=None, history=None, run_id=None):
+        self.csv_path = csv_path
+        self.jsonl_path = jsonl_path
+        self.history = history
+        self.run_id = run_id
+        self.history_error = None
+        # Why the writer stopped, when it could not write log.csv; raised by close()
+        self.error = None
+        self._queue = queue.Queue()
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # An exception already leaving the block is not replaced by the journal's own
+        try:
+            self.close()
+        except JournalError:
+            if exc_type is None:
+                raise
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='run-journal', daemon=True)
+            self._thread.start()
+
+    def record(self, **fields):
+        self._queue.put(fields)
+
+    def close(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+        if self.error is not None:
+            raise JournalError(f'The run journal could not be written to {self.csv_path}: {self.error}') from self.error
+
+    def _write_history(self, write):
+        # log.csv stays the record of truth: a failing history store is switched off for the rest of the run
+        if self.history is None:
+            return None
+        try:
+            return write()
+        except sqlite3.Error as e:
+            self.history_error = str(e)
+            self.history = None
+            return None
+
+    def _run(self):
+        # Records queued after a failure are lost, so the error is kept for close() instead of ending the thread silently
+        try:
+            self._write()
+        except Exception as e:
+            self.error = e
+
+    def _write(self):
+        if os.path.exists(self.csv_path):
+            upgrade_csv_header(self.csv_path)
+        new_file = not os.path.exists(self.csv_path) or os.path.getsize(self.csv_path) == 0
+        # Catch up on records written without the store, so it mirrors log.csv before this run appends to both
+        self._write_history(lambda: self.history.import_csv(self.csv_path))
+        history_run = self._write_history(lambda: self.history.start_run(self.run_id))
+
+        with open(self.csv_path, mode='a', newline='', encoding='utf-8') as csv_file:
+            jsonl_file = open(self.jsonl_path, mode='a', encoding='utf-8') if self.jsonl_path else None
+            try:
+                writer = csv.DictWriter(csv_file, fieldnames=JOURNAL_COLUMNS, extrasaction='ignore')
+                if new_file:
+                    writer.writeheader()
+
+                closed = False
+                while not closed:
+                    try:
+                        item = self._queue.get(timeout=FLUSH_INTERVAL)
+                    except queue.Empty:
+                        continue
+
+                    # Drain whatever else is already waiting, up to one batch
+                    batch = []
+                    while True:
+                        if item is None:
+                            closed = True
+                            break
+                        batch.append(item)
+                        if len(batch) >= BATCH_SIZE:
+                            break
+                        try:
+                            item = self._queue.get_nowait()
+                        except queue.Empty:
+                            break
+
+                    if batch:
+                        writer.writerows(batch)
+                        csv_file.flush()
+                        if jsonl_file:
+                            jsonl_file.writelines(json.dumps(record, default=str) + '\n' for record in batch)
+                            jsonl_file.flush()
+                        csv_offset = csv_file.tell()
+                        self._write_history(lambda: self.history.record_batch(history_run, batch, self.csv_path, csv_offset))
+            finally:
+                if jsonl_file:
+                    jsonl_file.close()
+                self._write_history(lambda: self.history.finish_run(history_run))
@@ -0,0 +1,43 @@
+import json
+import math
+
+# orjson is optional: it encodes several times faster than the standard library, which matters for transformation configs
+# carrying large code blocks. Without it the standard library is used with compact output. Decoding always uses the
+# standard library: orjson turns integers over 64 bits into floats and rejects NaN, which would change configs silently.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def has_non_finite(value):
+    if isinstance(value, float):
+        return not math.isfinite(value)
+    if isinstance(value, dict):
+        return any(has_non_finite(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return any(has_non_finite(item) for item in value)
+    return False
+
+
+def dumps(value, sort_keys=False):
+    # UTF-8 bytes; values orjson cannot encode (e.g. integers over 64 bits) fall back to the standard library.
+    # orjson writes NaN and Infinity as null without failing, so a body with a null is checked for them and, when one
+    # is found, encoded by the standard library, which keeps them as json.loads read them.
+    if orjson is not None:
+        try:
+            body = orjson.dumps(value, option=orjson.OPT_SORT_KEYS if sort_keys else 0)
+        except TypeError:
+            body = None
+        if body is not None and (b'null' not in body or not has_non_finite(value)):
+            return body
+    return json.dumps(value, sort_keys=sort_keys, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def loads(data):
+    return json.loads(data)
+
+
+def response_json(response):
+    # Decodes the raw response body directly instead of going through response.text
+    return loads(response.content)
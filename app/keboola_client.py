@@ -0,0 +1,240 @@
+import contextlib
+import datetime
+import email.utils
+import gzip
+import random
+import threading
+import time
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+from concurrency import get_limiter
+from json_codec import dumps
+from metrics import get_metrics
+
+# Migration workers per destination, each with its own pooled connection; the adaptive limiter decides how many are actually sending
+DEFAULT_POOL_SIZE = 32
+# (connect, read) timeout in seconds
+DEFAULT_TIMEOUT = (10, 300)
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'}
+MAX_RETRIES = 5
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30
+# JSON bodies at least this large are sent gzip-compressed; None turns compression off
+DEFAULT_COMPRESS_MIN_BYTES = 32 * 1024
+GZIP_LEVEL = 5
+# Words of a 400 answer that blame the body encoding rather than the request itself (e.g. "configuration already exists")
+COMPRESSION_ERROR_WORDS = ('encoding', 'gzip', 'compress', 'decod', 'malformed', 'syntax error', 'invalid json')
+
+
+def get_retry_after(response):
+    # Retry-After is either a number of seconds or an HTTP date. Capped at BACKOFF_MAX like our own backoff,
+    # so a far-off date or a huge value cannot stall a worker.
+    value = response.headers.get('Retry-After') if response is not None else None
+    if not value:
+        return None
+    try:
+        delay = float(value)
+    except ValueError:
+        try:
+            retry_at = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        delay = (retry_at - datetime.datetime.now(retry_at.tzinfo)).total_seconds()
+    return min(max(0.0, delay), BACKOFF_MAX)
+
+
+def is_compression_rejected(response):
+    # A stack without gzip support answers 415, or 400 with an error about the body it could not read
+    if response.status_code == 415:
+        return True
+    return response.status_code == 400 and any(word in response.text.lower() for word in COMPRESSION_ERROR_WORDS)
+
+
+def get_backoff(attempt):
+    # Full jitter exponential backoff
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+def next_retry(response, error, retry, attempt, max_retries):
+    # (reason, delay) when the request should be sent again, None when the response (or error) is final.
+    # Shared by both engines, which only differ in how they wait.
+    if response is not None and response.status_code not in RETRY_STATUSES:
+        return None
+    if not retry or attempt >= max_retries:
+        return None
+    reason = response.status_code if response is not None else type(error).__name__
+    delay = get_retry_after(response)
+    return reason, delay if delay is not None else get_backoff(attempt)
+
+
+def encode_json_body(value, compress_min_bytes):
+    # Body encoded once with the fast codec, and its gzip-compressed form when it is large enough (None otherwise)
+    body = dumps(value)
+    if compress_min_bytes is None or len(body) < compress_min_bytes:
+        return body, None
+    return body, gzip.compress(body, GZIP_LEVEL)
+
+
+def get_body_sizes(response):
+    # Bytes of the request body sent and of the response body received
+    body = response.request.body or b''
+    return len(body.encode('utf-8') if isinstance(body, str) else body), len(response.content)
+
+
+class RequestTrace:
+    # Requests made on behalf of one migrated object: count, bytes and the worst HTTP status seen
+
+    def __init__(self):
+        self.requests = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.http_status = None
+        self._lock = threading.Lock()
+
+    def record(self, response):
+        self.add(response.status_code, *get_body_sizes(response))
+
+    def add(self, status_code, bytes_sent, bytes_received):
+        with self._lock:
+            self.requests += 1
+            self.bytes_sent += bytes_sent
+            self.bytes_received += bytes_received
+            self.http_status = max(self.http_status or 0, status_code)
+
+
+class KeboolaClient:
+    # Storage API client for one project (URL + token) backed by a pooled keep-alive session
+
+    def __init__(self, url, token, pool_size=DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT, max_retries=MAX_RETRIES,
+                 compress_min_bytes=DEFAULT_COMPRESS_MIN_BYTES):
+        self.url = url if url.endswith('/') else f'{url}/'
+        self.token = token
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.compress_min_bytes = compress_min_bytes
+        # Shared by every project on the same stack
+        self.limiter = get_limiter(urlparse(self.url).netloc)
+
+        self.session = requests.Session()
+        self.session.headers.update({'X-StorageApi-Token': token, 'Connection': 'keep-alive'})
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        # Optional caps on in-flight requests: this project only, and a semaphore shared by a whole run
+        self.in_flight = None
+        self.global_limit = None
+
+    def set_limits(self, max_in_flight=None, global_limit=None):
+        self.in_flight = threading.BoundedSemaphore(max_in_flight) if max_in_flight else None
+        self.global_limit = global_limit
+
+    def send(self, method, path, **kwargs):
+        # Project cap is always taken before the shared one and the host limiter, so waiting threads cannot deadlock
+        with self.in_flight or contextlib.nullcontext(), self.global_limit or contextlib.nullcontext():
+            self.limiter.acquire()
+            throttled = False
+            # Timed once a request may go out, so waiting for a concurrency slot does not count as latency
+            started = time.monotonic()
+            try:
+                response = self.session.request(method, f'{self.url}{path}', **kwargs)
+                throttled = response.status_code in RETRY_STATUSES
+                get_metrics().observe_request(method, path, response.status_code, time.monotonic() - started, *get_body_sizes(response))
+                return response
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                throttled = True
+                get_metrics().observe_request(method, path, type(e).__name__, time.monotonic() - started)
+                raise
+            finally:
+                self.limiter.release(throttled)
+
+    def request(self, method, path, retry=None, trace=None, **kwargs):
+        # json= bodies are encoded once with the fast codec, and compressed when large; retries reuse the encoded body
+        if 'json' not in kwargs:
+            return self._request(method, path, retry, trace, **kwargs)
+
+        body, compressed = encode_json_body(kwargs.pop('json'), self.compress_min_bytes)
+        kwargs['headers'] = dict(kwargs.get('headers') or {}, **{'Content-Type': 'application/json'})
+        if compressed is None:
+            return self._request(method, path, retry, trace, data=body, **kwargs)
+
+        compressed_headers = dict(kwargs['headers'], **{'Content-Encoding': 'gzip'})
+        response = self._request(method, path, retry, trace, data=compressed, **dict(kwargs, headers=compressed_headers))
+        if not is_compression_rejected(response):
+            return response
+        # Send the plain body, and stop compressing when that is accepted
+        response = self._request(method, path, retry, trace, data=body, **kwargs)
+        if not is_compression_rejected(response):
+            self.compress_min_bytes = None
+        return response
+
+    def _request(self, method, path, retry=None, trace=None, **kwargs):
+        # Idempotent methods are retried by default; callers pass retry=True for upserts that are safe to repeat
+        kwargs.setdefault('timeout', self.timeout)
+        retry = method in IDEMPOTENT_METHODS if retry is None else retry
+
+        attempt = 0
+        while True:
+            try:
+                response = self.send(method, path, **kwargs)
+                error = None
+                if trace is not None:
+                    trace.record(response)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                response = None
+                error = e
+
+            retry_after = next_retry(response, error, retry, attempt, self.max_retries)
+            if retry_after is None:
+                if error is not None:
+                    raise error
+                return response
+
+            reason, delay = retry_after
+            self.limiter.record_retry(reason)
+            get_metrics().record_retry(method, path, reason)
+            time.sleep(delay)
+            attempt += 1
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+    def put(self, path, **kwargs):
+        return self.request('PUT', path, **kwargs)
+
+    def delete(self, path, **kwargs):
+        return self.request('DELETE', path, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(url, token, pool_size=DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT):
+    # One shared client per project, so Streamlit reruns and repeated calls reuse open connections
+    key = (url, token)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None or client.pool_size != pool_size or client.timeout != timeout:
+            if client is not None:
+                client.close()
+            client = KeboolaClient(url, token, pool_size=pool_size, timeout=timeout)
+            _clients[key] = client
+        return client
+
+
+def close_clients():
+    with _clients_lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
@@ -0,0 +1,39 @@
+import concurrent.futures
+from json_codec import response_json
+
+# Configuration metadata carried over to the destination, e.g. KBC.configuration.folderName
+METADATA_KEY_PREFIXES = ('KBC.configuration.',)
+METADATA_WORKERS = 16
+
+
+def metadata_key(component_id, config_id):
+    return f'{component_id}/{config_id}'
+
+
+def get_config_metadata(client, component_id, config_id, BRANCH='default'):
+    response = client.get(f'v2/storage/branch/{BRANCH}/components/{component_id}/configs/{config_id}/metadata')
+    response.raise_for_status()
+    return relevant_metadata(response_json(response))
+
+
+def relevant_metadata(items):
+    return [{'key': item['key'], 'value': item['value']} for item in items if item['key'].startswith(METADATA_KEY_PREFIXES)]
+
+
+def prefetch_metadata(client, configs, BRANCH='default', workers=METADATA_WORKERS):
+    # Metadata of every config, read concurrently before any write starts; configs without relevant keys are left out
+    keys = [(config['component_id'], config['id']) for config in configs]
+    if not keys:
+        return {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(workers, len(keys))) as executor:
+        results = executor.map(lambda key: get_config_metadata(client, key[0], key[1], BRANCH), keys)
+        return {metadata_key(*key): items for key, items in zip(keys, results) if items}
+
+
+def metadata_payload(items):
+    # All keys of one config in a single form-encoded request
+    payload = {}
+    for i, item in enumerate(items):
+        payload[f'metadata[{i}][key]'] = item['key']
+        payload[f'metadata[{i}][value]'] = item['value']
+    return payload
@@ -0,0 +1,215 @@
+import bisect
+import collections
+import json
+import re
+import threading
+import time
+
+METRICS_JSON_PATH = 'metrics.json'
+METRICS_PROMETHEUS_PATH = 'metrics.prom'
+# Upper bounds of the request latency buckets, in seconds
+LATENCY_BUCKETS = (0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# Endpoint classes, matched on the path with the optional branch prefix removed
+ENDPOINT_PATTERNS = (
+    ('metadata', re.compile(r'^v2/storage/components/[^/]+/configs/[^/]+/metadata$')),
+    ('row_write', re.compile(r'^v2/storage/components/[^/]+/configs/[^/]+/rows(/[^/]+)?$')),
+    ('config_write', re.compile(r'^v2/storage/components/[^/]+/configs(/[^/]+)?$')),
+    ('list_components', re.compile(r'^v2/storage/components$')),
+    ('preflight', re.compile(r'^v2/storage(/tokens/verify|/dev-branches)?$')),
+)
+BRANCH_PREFIX = re.compile(r'^v2/storage/branch/[^/]+/')
+
+
+def endpoint_class(method, path):
+    path = BRANCH_PREFIX.sub('v2/storage/', path.split('?', 1)[0].strip('/'))
+    for name, pattern in ENDPOINT_PATTERNS:
+        if pattern.match(path):
+            # Reads of configs and rows are listings or detail fetches, not writes
+            if method == 'GET' and name == 'config_write':
+                return 'get_config' if path.count('/') > 4 else 'list_configs'
+            if method == 'GET' and name == 'row_write':
+                return 'list_configs'
+            return name
+    return 'other'
+
+
+class LatencyHistogram:
+    # Cumulative-bucket histogram in the Prometheus sense, plus enough to show approximate percentiles
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, fraction):
+        # Upper bound of the bucket holding the requested fraction of observations
+        if not self.count:
+            return None
+        threshold = fraction * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= threshold:
+                return round(min(bound, self.max), 3)
+        return round(self.max, 3)
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            yield bound, total
+
+
+class EndpointStats:
+
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.statuses = collections.Counter()
+        self.retries = collections.Counter()
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+
+class MetricsRegistry:
+    # Storage API calls of a run per endpoint class: latency, status codes, bytes and retries, plus migrated configs
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = time.monotonic()
+            self.endpoints = collections.defaultdict(EndpointStats)
+            self.configs = collections.Counter()
+
+    def observe_request(self, method, path, status, seconds, bytes_sent=0, bytes_received=0):
+        # status is the HTTP status code, or the exception name when no response came back
+        with self._lock:
+            stats = self.endpoints[endpoint_class(method, path)]
+            stats.latency.observe(seconds)
+            stats.statuses[str(status)] += 1
+            stats.bytes_sent += bytes_sent
+            stats.bytes_received += bytes_received
+
+    def record_retry(self, method, path, reason):
+        with self._lock:
+            self.endpoints[endpoint_class(method, path)].retries[str(reason)] += 1
+
+    def record_config(self, success):
+        with self._lock:
+            self.configs['migrated' if success else 'failed'] += 1
+
+    def snapshot(self):
+        with self._lock:
+            elapsed = time.monotonic() - self.started
+            endpoints = {}
+            for name, stats in sorted(self.endpoints.items()):
+                latency = stats.latency
+                endpoints[name] = {
+                    'requests': latency.count,
+                    'seconds_total': round(latency.sum, 3),
+                    'latency_avg': round(latency.sum / latency.count, 3) if latency.count else None,
+                    'latency_p50': latency.percentile(0.5),
+                    'latency_p95': latency.percentile(0.95),
+                    'latency_max': round(latency.max, 3),
+                    'latency_buckets': {('+Inf' if bound == float('inf') else str(bound)): count for bound, count in latency.cumulative()},
+                    'statuses': dict(stats.statuses),
+                    'retries': dict(stats.retries),
+                    'bytes_sent': stats.bytes_sent,
+                    'bytes_received': stats.bytes_received,
+                }
+            done = self.configs['migrated'] + self.configs['failed']
+            return {
+                'elapsed_seconds': round(elapsed, 3),
+                'configs_migrated': self.configs['migrated'],
+                'configs_failed': self.configs['failed'],
+                'configs_per_second': round(done / elapsed, 3) if elapsed > 0 else 0.0,
+                'requests_per_second': round(sum(item['requests'] for item in endpoints.values()) / elapsed, 3) if elapsed > 0 else 0.0,
+                'endpoints': endpoints,
+            }
+
+    def to_prometheus(self):
+        with self._lock:
+            return self._prometheus_lines(time.monotonic() - self.started, sorted(self.endpoints.items()), self.configs)
+
+    def _prometheus_lines(self, elapsed, endpoints, configs):
+        lines = [
+            '# HELP keboola_migration_request_duration_seconds Storage API request latency per endpoint class',
+            '# TYPE keboola_migration_request_duration_seconds histogram',
+        ]
+        for name, stats in endpoints:
+            for bound, count in stats.latency.cumulative():
+                le = '+Inf' if bound == float('inf') else repr(float(bound))
+                lines.append(f'keboola_migration_request_duration_seconds_bucket{{endpoint="{name}",le="{le}"}} {count}')
+            lines.append(f'keboola_migration_request_duration_seconds_sum{{endpoint="{name}"}} {stats.latency.sum:.6f}')
+            lines.append(f'keboola_migration_request_duration_seconds_count{{endpoint="{name}"}} {stats.latency.count}')
+
+        lines += ['# HELP keboola_migration_responses_total Storage API responses per endpoint class and status',
+                  '# TYPE keboola_migration_responses_total counter']
+        for name, stats in endpoints:
+            for status, count in sorted(stats.statuses.items()):
+                lines.append(f'keboola_migration_responses_total{{endpoint="{name}",status="{status}"}} {count}')
+
+        lines += ['# HELP keboola_migration_retries_total Retried Storage API requests per endpoint class and reason',
+                  '# TYPE keboola_migration_retries_total counter']
+        for name, stats in endpoints:
+            for reason, count in sorted(stats.retries.items()):
+                lines.append(f'keboola_migration_retries_total{{endpoint="{name}",reason="{reason}"}} {count}')
+
+        for direction in ('sent', 'received'):
+            lines += [f'# HELP keboola_migration_bytes_{direction}_total Request and response body bytes {direction} per endpoint class',
+                      f'# TYPE keboola_migration_bytes_{direction}_total counter']
+            for name, stats in endpoints:
+                lines.append(f'keboola_migration_bytes_{direction}_total{{endpoint="{name}"}} {getattr(stats, f"bytes_{direction}")}')
+
+        lines += ['# HELP keboola_migration_configs_total Migrated configurations per result',
+                  '# TYPE keboola_migration_configs_total counter']
+        for result in ('migrated', 'failed'):
+            lines.append(f'keboola_migration_configs_total{{result="{result}"}} {configs.get(result, 0)}')
+        lines += ['# HELP keboola_migration_elapsed_seconds Seconds since the metrics were reset',
+                  '# TYPE keboola_migration_elapsed_seconds gauge',
+                  f'keboola_migration_elapsed_seconds {elapsed:.3f}']
+        return '\n'.join(lines) + '\n'
+
+    def export(self, json_path=METRICS_JSON_PATH, prometheus_path=METRICS_PROMETHEUS_PATH):
+        if json_path:
+            with open(json_path, 'w', encoding='utf-8') as file:
+                json.dump(self.snapshot(), file, indent=2)
+        if prometheus_path:
+            with open(prometheus_path, 'w', encoding='utf-8') as file:
+                file.write(self.to_prometheus())
+
+
+def summary_rows(snapshot):
+    # One row per endpoint class for tables and console output
+    return [{
+        'endpoint': name,
+        'requests': item['requests'],
+        'seconds': item['seconds_total'],
+        'avg s': item['latency_avg'],
+        'p50 s': item['latency_p50'],
+        'p95 s': item['latency_p95'],
+        'max s': item['latency_max'],
+        'statuses': ', '.join(f'{status}: {count}' for status, count in sorted(item['statuses'].items())),
+        'retries': sum(item['retries'].values()),
+        'kB sent': round(item['bytes_sent'] / 1024, 1),
+        'kB received': round(item['bytes_received'] / 1024, 1),
+    } for name, item in snapshot['endpoints'].items()]
+
+
+_metrics = MetricsRegistry()
+
+
+def get_metrics():
+    # One registry per process; a run resets it when it starts
+    return _metrics
@@ -1,9 +1,28 @@
 import streamlit as st
 import re
+import datetime
 import json
 import os
-from requests.exceptions import ConnectionError, Timeout
-from config_migrator import get_keboola_configs, migrate_configs, get_component_ids, get_component_configurations
+import queue
+import threading
+import time
+from catalog_cache import cached_component_ids, cached_component_configurations, catalog_age, get_catalog_cache
+from dependency_graph import DependencyGraph, index_variables_by_config
+from checkpoint import make_run_id
+from concurrency import get_limiter_stats
+import async_engine
+from async_engine import DEFAULT_ASYNC_GLOBAL_IN_FLIGHT, DEFAULT_ASYNC_DESTINATION_IN_FLIGHT
+from engine import load_source_snapshot, get_migrate_destinations
+from fanout import DEFAULT_MAX_DESTINATIONS, DEFAULT_GLOBAL_IN_FLIGHT, DEFAULT_DESTINATION_IN_FLIGHT
+from journal import JournalError
+from keboola_client import get_client
+from metrics import get_metrics, summary_rows, METRICS_JSON_PATH, METRICS_PROMETHEUS_PATH
+from planner import plan_destinations
+from preflight import preflight_destinations, plan_component_ids, excluded_summary
+from source_snapshot import SourceSnapshot
+
+# How often the live request metrics are redrawn during a migration
+METRICS_REFRESH_SECONDS = 1.0
 
 def main():
     st.title("Project Metadata Migration")
@@ -67,23 +86,21 @@ def main():
         st.markdown(f"The selected configurations will be migrated to: {dest_project_names_str}")
 
     if source_project_host and source_api_token and destination_selected_project_details:
-        HEAD = {'X-StorageApi-Token': source_api_token}
-        HEAD_FORM = {'X-StorageApi-Token': source_api_token, 'Content-Type': 'application/x-www-form-urlencoded'}
+        source_client = get_client(source_project_host, source_api_token)
         # Migrate Configurations in the main area
         st.subheader("Migrate Configurations")
         st.markdown("All components will be migrated unless you select 'Keep' or 'Skip' to only migrate or skip selected Component IDs. Select an option in the process settings from the left panel.")
         st.sidebar.title("Process Settings")
         processing_detail = st.sidebar.selectbox("Processing Detail", ["", "Keep", "Skip"])
         
-        # Load available component options only once
-        if 'available_component_options' not in st.session_state:
-            with st.spinner("Fetching available components..."):
-                st.session_state.available_component_options = get_component_ids(source_project_host, {'X-StorageApi-Token':source_api_token})
-        available_component_options = st.session_state.available_component_options
+        # Component and configuration lists come from a cache per source project, so widget changes do not call the API again
+        if st.sidebar.button("Refresh source catalog"):
+            get_catalog_cache().clear(source_client)
+        with st.spinner("Fetching available components..."):
+            available_component_options = cached_component_ids(source_client)
+        st.sidebar.caption(f"Source catalog loaded {int(catalog_age(source_client) or 0)} s ago")
 
         component_ids = []
-        shared_code_ids_snowflake = []
-        shared_code_ids_python = []
 
         if processing_detail:
             ignoreflow = st.sidebar.checkbox("Include orchestrator and scheduler", value=False)
@@ -116,11 +133,11 @@ def main():
             configuration_options = None
             with st.spinner("Fetching configurations..."):
                 if skip:
-                    configuration_options = get_component_configurations(source_project_host, {'X-StorageApi-Token':source_api_token}, component_ids, 'skip')
+                    configuration_options = cached_component_configurations(source_client, component_ids, 'skip')
                 elif keep:
-                    configuration_options = get_component_configurations(source_project_host, {'X-StorageApi-Token':source_api_token}, component_ids, 'keep')
+                    configuration_options = cached_component_configurations(source_client, component_ids, 'keep')
                 else:
-                    configuration_options = get_component_configurations(source_project_host, {'X-StorageApi-Token':source_api_token}, None, 'all')
+                    configuration_options = cached_component_configurations(source_client, None, 'all')
 
             # Remove orchestrators and schedulers from configurations
             components_to_ignore = [] if ignoreflow else ["keboola.scheduler", "keboola.orchestrator"]
@@ -158,87 +175,104 @@ def main():
             # Adds variables related to the selected transformation
             include_variable = st.sidebar.checkbox("Include migration of variables related to selected transformations (Python and Snowflake)", value=True)
             if include_variable:
-                all_variables_ids = get_component_configurations(source_project_host, {'X-StorageApi-Token':source_api_token}, ["keboola.variables"], 'keep')
+                variables_by_config = index_variables_by_config(cached_component_configurations(source_client, ["keboola.variables"], 'keep'))
                 variables_ids = []
-
+                # (component_id, config_id) of everything selected so far, so each variables config is added once
+                seen_keys = {(config[0], config[2]) for config in configuration_ids}
                 for config in configuration_ids:
-                    config_id = config[2] 
-                    match_found = False
-
-                    for variable in all_variables_ids:
-                        variable_definition = variable[1]  
-
-                        if variable_definition.endswith(config_id):
-                            match_found = True
-                            variables_ids.append(variable) 
+                    for variable in variables_by_config.get(config[2], []):
+                        if (variable[0], variable[2]) not in seen_keys:
+                            seen_keys.add((variable[0], variable[2]))
+                            variables_ids.append(variable)
 
                 configuration_ids.extend(variables_ids)
 
             # Adds variables related to the selected transformation
             include_shared_code = st.sidebar.checkbox("Include shared codes related to selected transformations (Python and Snowflake)", value=True)
-            if include_shared_code:
-                shared_codes = get_component_configurations(source_project_host, {'X-StorageApi-Token':source_api_token}, ["keboola.shared-code"], 'keep')
-                if shared_codes:
-                    shared_code_configs = get_keboola_configs(source_project_host, HEAD, skip, keep, shared_codes)
-                else:
-                    shared_code_configs = []
-
-            #st.write(shared_code_configs)
 
         # Initialize session state for the first button
         if 'config_loaded' not in st.session_state:
             st.session_state['config_loaded'] = False
 
+        # Source snapshot file, so a later run can start without reading the source project again
+        snapshot_path = st.sidebar.text_input("Source snapshot file", value="source_snapshot.json.gz")
+        save_snapshot = st.sidebar.checkbox("Save source snapshot after loading", value=False)
+
+        # Migration engine: worker threads, or coroutines on one event loop for very large runs (needs aiohttp)
+        engines = ["threads", "asyncio"] if async_engine.is_available() else ["threads"]
+        engine = st.sidebar.selectbox("Migration engine", engines)
+        if not async_engine.is_available():
+            st.sidebar.caption("Install aiohttp to enable the asyncio engine")
+
+        # Fan-out limits for migrating several destination projects at once
+        max_destinations = st.sidebar.number_input("Destination projects migrated in parallel", min_value=1, max_value=64, value=DEFAULT_MAX_DESTINATIONS)
+        global_in_flight = st.sidebar.number_input("Max in-flight requests (all projects)", min_value=1, max_value=8192,
+                                                   value=DEFAULT_ASYNC_GLOBAL_IN_FLIGHT if engine == "asyncio" else DEFAULT_GLOBAL_IN_FLIGHT)
+        destination_in_flight = st.sidebar.number_input("Max in-flight requests per project", min_value=1, max_value=4096,
+                                                        value=DEFAULT_ASYNC_DESTINATION_IN_FLIGHT if engine == "asyncio" else DEFAULT_DESTINATION_IN_FLIGHT)
+        incremental = st.sidebar.checkbox("Incremental migration (skip configurations and rows that already match the destination)", value=False)
+        write_jsonl = st.sidebar.checkbox("Also write the run journal as JSONL (log.jsonl)", value=False)
+
         # First button
-        if st.button("Load Configurations"):
+        col_load, col_snapshot = st.columns([1, 1])
+        with col_load:
+            load_clicked = st.button("Load Configurations")
+        with col_snapshot:
+            load_snapshot_clicked = st.button("Load Snapshot File")
+
+        if load_clicked:
             with st.spinner("Loading configurations..."):
-                if only_selected_configs and len(configuration_ids) > 0:
-                    configs = get_keboola_configs(source_project_host, HEAD, skip, keep, configuration_ids)
-                else:
-                    configs = get_keboola_configs(source_project_host, HEAD, skip, keep)
-
-                st.write("Configurations to migrate:")
-                # Display the loaded configurations
-
-                # Store shared_code_ids in session state
-                st.session_state.shared_code_ids_snowflake = []
-                st.session_state.shared_code_ids_python = []
-             
-                for config in configs:
-                    component_id = config.get("component_id")
-                    name = config.get("name")
-                    config_id = config.get("id")
-        
-                    st.write(f"**{component_id}** name **{name}** and ID **{config_id}**")
- 
-                    if include_shared_code:
-                        # Select shared_code for Python and Snowflake transforamtion
-                        if config.get('component_id') == "keboola.snowflake-transformation":
-                            configuration = config.get('configuration', {})
-                            shared_code_row_ids = configuration.get('shared_code_row_ids', [])
-                            if shared_code_row_ids:
-                                st.session_state.shared_code_ids_snowflake.extend(shared_code_row_ids)
-
-                        elif config.get('component_id') == "keboola.python-transformation-v2":
-                            configuration = config.get('configuration', {})
-                            shared_code_row_ids = configuration.get('shared_code_row_ids', [])
-                            if shared_code_row_ids:
-                                st.session_state.shared_code_ids_python.extend(shared_code_row_ids)
-
-                if include_shared_code:
-                    st.write("Shared code for selected **Python and Snowflake transformations** will also be migrated")
-              
-                st.write("")
-                st.write("Clicking on button **Migrate Configurations** will migrate the following configurations. Click on **Dismiss Configurations** to clear the configuration selection")
-                # Set the state after configurations are loaded
-                st.session_state['config_loaded'] = True
+                selected_configs = configuration_ids if only_selected_configs and len(configuration_ids) > 0 else None
+                with_shared_code = bool(only_selected_configs and include_shared_code)
+                st.session_state.source_snapshot = load_source_snapshot(source_client, source_selected_project, skip, keep, selected_configs,
+                                                                        with_shared_code, st.write)
+                if save_snapshot:
+                    st.session_state.source_snapshot.save(snapshot_path)
+                    st.write(f"Source snapshot saved to **{snapshot_path}**")
+
+        if load_snapshot_clicked:
+            if os.path.exists(snapshot_path):
+                st.session_state.source_snapshot = SourceSnapshot.load(snapshot_path)
+                st.write(f"Source snapshot of **{st.session_state.source_snapshot.source_name}** created at {st.session_state.source_snapshot.created_at} loaded from **{snapshot_path}**")
+            else:
+                st.write(f"Snapshot file not found: {snapshot_path}")
+
+        if (load_clicked or load_snapshot_clicked) and 'source_snapshot' in st.session_state:
+            snapshot = st.session_state.source_snapshot
+            st.write("Configurations to migrate:")
+            # Display the loaded configurations
+            for config in snapshot.configs:
+                component_id = config.get("component_id")
+                name = config.get("name")
+                config_id = config.get("id")
+
+                st.write(f"**{component_id}** name **{name}** and ID **{config_id}**")
+
+            if snapshot.shared_code_configs:
+                st.write("Shared code for selected **Python and Snowflake transformations** will also be migrated")
+
+            waves = DependencyGraph(snapshot.shared_code_configs + snapshot.configs).waves()
+            if len(waves) > 1:
+                st.write(f"Referenced shared codes, variables and flow tasks are migrated before the configurations using them ({len(waves)} dependency levels)")
+
+            st.write("")
+            st.write("Clicking on button **Migrate Configurations** will migrate the following configurations. Click on **Dismiss Configurations** to clear the configuration selection")
+            # Set the state after configurations are loaded
+            st.session_state['config_loaded'] = True
 
         # Second button, which appears only after the configurations are loaded
         # Flag to determine whether migration process has started
         migrate_clicked = False
 
+        resume_clicked = False
+        plan_clicked = False
+
         # Ensure the configuration is loaded before showing buttons
         if st.session_state['config_loaded']:
+            # The run ID is stable for the same source selection and destinations, so an interrupted run can be resumed
+            run_id = make_run_id(st.session_state.source_snapshot, dest_project_names)
+            st.write(f"Run ID: **{run_id}**")
+
             # Display buttons only if migrate_clicked is False
             if not migrate_clicked:
                 col1, col2, col3, col4 = st.columns([1, 1, 1, 1])
@@ -251,9 +285,39 @@ def main():
                         st.session_state.clear()
                         st.experimental_rerun()
 
-            # If "Migrate Configurations" is clicked, update state and rerun
-            if migrate_clicked:
-                total_projects = len(destination_selected_project_details)
+                with col3:
+                    resume_clicked = st.button("Resume Migration")
+
+                with col4:
+                    plan_clicked = st.button("Plan Migration")
+
+            # Dry run: what every destination would get, without writing anything
+            if plan_clicked:
+                with st.spinner("Planning migration..."):
+                    plans, estimated_seconds = plan_destinations(st.session_state.source_snapshot, destination_selected_project_details, 'default', incremental,
+                                                                 max_destinations, global_in_flight, destination_in_flight)
+                st.subheader("Migration Plan")
+                st.write(f"Estimated duration of the whole run: **{datetime.timedelta(seconds=int(estimated_seconds))}**")
+                st.table([{key: value for key, value in plan.items() if key != 'items'} for plan in plans.values()])
+                for plan in plans.values():
+                    latency_source = "measured in previous runs" if plan['latency_measured'] else "default, no previous runs"
+                    with st.expander(f"{plan['destination']}: {plan['calls']} API calls, {plan['request_latency']:.3f} s per call ({latency_source})"):
+                        st.table(plan['items'])
+
+            # If "Migrate Configurations" or "Resume Migration" is clicked, update state and rerun
+            if migrate_clicked or resume_clicked:
+                snapshot = st.session_state.source_snapshot
+                BRANCH_DEST = 'default'
+
+                # Preflight of every destination at once: token, branch and the components of the plan. Projects failing it are
+                # left out with the reason, the rest start right away.
+                with st.spinner("Checking destination projects..."):
+                    healthy_projects, excluded_projects = preflight_destinations(destination_selected_project_details, BRANCH_DEST,
+                                                                                 plan_component_ids(snapshot))
+                for destination_project_name, reason in excluded_projects.items():
+                    st.error(f"**{destination_project_name}** is excluded from the migration: {reason}")
+
+                total_projects = len(healthy_projects)
                 st.subheader("Migration Progress")
                 percent_complete_text = st.empty()  # Placeholder for dynamic status text
                 percent_complete_text.text("0 %")
@@ -261,59 +325,118 @@ def main():
                 progress_bar = st.progress(0)
                 status_text = st.empty()  # Placeholder for dynamic status text
 
-                for i, dest_project in enumerate(destination_selected_project_details):
-                    destination_api_token = dest_project['token']
+                # One progress bar per destination project
+                destination_progress = {}
+                for dest_project in healthy_projects:
+                    st.markdown(f"**{dest_project['name']}**")
+                    destination_progress[dest_project['name']] = (st.progress(0), st.empty())
+
+                # Live per-endpoint request metrics, refreshed while the events are drained
+                st.markdown("**Storage API requests**")
+                metrics_text = st.empty()
+                metrics_table = st.empty()
+                metrics = get_metrics()
+                metrics.reset()
+
+                def show_metrics():
+                    metrics_snapshot = metrics.snapshot()
+                    metrics_text.text(f"{metrics_snapshot['configs_per_second']} configurations/s, {metrics_snapshot['requests_per_second']} requests/s")
+                    rows = summary_rows(metrics_snapshot)
+                    if rows:
+                        metrics_table.table(rows)
+
+                # The fan-out runs in a worker thread, only this thread touches Streamlit
+                events = queue.Queue()
+                result = {}
+
+                migrate_destinations = get_migrate_destinations(engine)
+
+                def run_fanout():
+                    try:
+                        result['summaries'] = migrate_destinations(snapshot, healthy_projects, BRANCH_DEST,
+                                                                   max_destinations, global_in_flight, destination_in_flight, events.put, incremental,
+                                                                   'log.jsonl' if write_jsonl else None, run_id, resume_clicked)
+                    except JournalError as e:
+                        result['journal_error'] = str(e)
+
+                worker = threading.Thread(target=run_fanout, daemon=True)
+                worker.start()
+                status_text.text(f"Migrating {total_projects} projects, up to {max_destinations} at once, {engine} engine")
+
+                total_configs = (len(snapshot.shared_code_configs) + len(snapshot.configs)) * total_projects
+                done_configs = {}
+                resumed_configs = {}
+                log_messages = {}
+                metrics_shown = 0.0
+                while worker.is_alive() or not events.empty():
+                    if time.monotonic() - metrics_shown >= METRICS_REFRESH_SECONDS:
+                        show_metrics()
+                        metrics_shown = time.monotonic()
+                    try:
+                        event = events.get(timeout=0.2)
+                    except queue.Empty:
+                        continue
+
+                    destination_project_name = event['destination']
+                    destination_bar, destination_text = destination_progress[destination_project_name]
+                    if event['type'] == 'destination_started':
+                        resumed_configs[destination_project_name] = event['resumed']
+                        if event['resumed']:
+                            log_messages.setdefault(destination_project_name, []).append(f"Resuming run {run_id}: {event['resumed']} configurations were already completed")
+                    elif event['type'] == 'config_done':
+                        done_configs[destination_project_name] = event['done']
+                        destination_bar.progress(event['done'] / event['total'])
+                        destination_text.text(f"{event['done']} of {event['total']} configurations")
+                    elif event['type'] == 'message':
+                        log_messages.setdefault(destination_project_name, []).append(event['message'])
+                    elif event['type'] == 'destination_finished':
+                        done_configs[destination_project_name] = event['total']
+                        destination_bar.progress(1.0)
+                        destination_text.text(f"Finished: {event['migrated']} migrated, {event['failed']} failed")
+
+                    # Update progress bar and percentage text as configurations complete
+                    overall = (sum(done_configs.values()) + sum(resumed_configs.values())) / total_configs if total_configs else 1.0
+                    percent_complete_text.text(f"{int(overall * 100)} %")
+                    progress_bar.progress(min(overall, 1.0))
+                worker.join()
+                show_metrics()
+                if result.get('journal_error'):
+                    st.error(result['journal_error'])
+                metrics.export(METRICS_JSON_PATH, METRICS_PROMETHEUS_PATH)
+                st.write(f"Request metrics saved to **{METRICS_JSON_PATH}** and **{METRICS_PROMETHEUS_PATH}**")
+
+                # Adaptive concurrency reached per API host, and the retries it took
+                for host, limiter_stats in get_limiter_stats().items():
+                    st.write(f"**{host}**: concurrency limit {limiter_stats['limit']}, retries {limiter_stats['retries'] or 'none'}")
+
+                # Failure summary per destination project
+                summaries = dict(result.get('summaries', {}), **{name: excluded_summary(name, reason) for name, reason in excluded_projects.items()})
+                for dest_project in destination_selected_project_details:
                     destination_project_name = dest_project['name']
+                    summary = summaries.get(destination_project_name)
+                    st.subheader(f"Migration to the {destination_project_name} project")
+                    for message in log_messages.get(destination_project_name, []):
+                        st.write(message)
 
-                    # Update status text to show the current project being migrated
-                    status_text.text(f"Migrating project {i + 1} of {total_projects}: {destination_project_name}")
-
-                    # Execute migrate configurations script for all selected projects
-                    HEAD = {'X-StorageApi-Token': source_api_token}
-                    HEAD_FORM = {'X-StorageApi-Token': source_api_token, 'Content-Type': 'application/x-www-form-urlencoded'}
-                    HEAD_DEST = {'X-StorageApi-Token': destination_api_token}
-                    HEAD_FORM_DEST = {'X-StorageApi-Token': destination_api_token, 'Content-Type': 'application/x-www-form-urlencoded'}
-                    BRANCH_DEST = 'default'
-
-                    st.subheader(f"The configuration migration to the {destination_project_name} project is in progress")
-
-                    # Retrieve shared_code_ids from session state
-                    shared_code_ids_snowflake = st.session_state.get('shared_code_ids_snowflake', [])
-                    shared_code_ids_python = st.session_state.get('shared_code_ids_python', [])
-
-                    try:
-                        if only_selected_configs and len(configuration_ids) > 0:
-                            configs = get_keboola_configs(source_project_host, HEAD, skip, keep, configuration_ids)
-                            if include_shared_code:
-                                for shared_code in shared_code_configs:
-                                    if shared_code.get("configuration", {}).get("componentId") == "keboola.python-transformation-v2":
-                                        shared_code["rows"] = [row for row in shared_code["rows"] if row["id"] in shared_code_ids_python]
-                                    elif shared_code.get("configuration", {}).get("componentId") == "keboola.snowflake-transformation":
-                                        shared_code["rows"] = [row for row in shared_code["rows"] if row["id"] in shared_code_ids_snowflake]
-                                #st.write(shared_code_configs)
-                                if shared_code_configs:
-                                    migrate_shared_code = migrate_configs(source_project_host, HEAD, shared_code_configs, HEAD_DEST, HEAD_FORM_DEST, BRANCH_DEST, source_selected_project, destination_project_name,  DEBUG=False)
-                        else:
-                            configs = get_keboola_configs(source_project_host, HEAD, skip, keep)
-
-                        fails = migrate_configs(source_project_host, HEAD, configs, HEAD_DEST, HEAD_FORM_DEST, BRANCH_DEST, source_selected_project, destination_project_name, DEBUG=False)
-                        st.write(f"Migration to {destination_project_name} completed. Failures:", fails)
-
-                    except (ConnectionError, Timeout) as conn_err:
+                    if summary is None:
+                        st.warning(f"Something went wrong with the migration to {destination_project_name}. Please try again later.")
+                    elif summary['error'] and summary['connection_error']:
                         st.warning(f"Connection error occurred while migrating to {destination_project_name}. Please check your internet connection and try again.")
-                        st.error(f"Error details: {conn_err}")
-                    except Exception as e:
+                        st.error(f"Error details: {summary['error']}")
+                    elif summary['error']:
                         st.warning(f"Something went wrong with the migration to {destination_project_name}. Please try again later.")
-                        st.error(f"Error details: {e}")
+                        st.error(f"Error details: {summary['error']}")
+                    else:
+                        st.write(f"Migration to {destination_project_name} completed. Failures:", summary['fails'])
 
-                    # Update progress bar and percentage text after completing each project
-                    percent_complete = int(((i + 1) / total_projects) * 100)
-                    percent_complete_text.text(f"{percent_complete} %")
-                    progress_bar.progress((i + 1) / total_projects)
+                    if summary and summary['counts']:
+                        counts = summary['counts']
+                        st.write(f"Configurations: {counts['configs_unchanged']} unchanged, {counts['configs_created']} created, {counts['configs_updated']} updated. "
+                                 f"Rows: {counts['rows_unchanged']} unchanged, {counts['rows_created']} created, {counts['rows_updated']} updated.")
 
                 # Final status update after all migrations are complete
                 status_text.text("Migration completed!")
-                if fails == []:
+                if len(summaries) == len(destination_selected_project_details) and all(not summary['fails'] and not summary['error'] for summary in summaries.values()):
                     st.balloons()
 
                 # Optionally, clear the session state if needed
@@ -0,0 +1,273 @@
+import argparse
+import datetime
+import os
+import sys
+import threading
+import time
+
+# Sibling modules are imported the same way the Streamlit page imports them
+script_dir = os.path.dirname(os.path.abspath(__file__))
+if script_dir not in sys.path:
+    sys.path.insert(0, script_dir)
+
+from checkpoint import make_run_id, make_stream_run_id, CheckpointStore, CHECKPOINT_PATH
+from concurrency import get_limiter_stats
+import async_engine
+from async_engine import DEFAULT_ASYNC_GLOBAL_IN_FLIGHT, DEFAULT_ASYNC_DESTINATION_IN_FLIGHT
+from engine import load_projects, find_projects, load_source_snapshot, get_migrate_destinations, ENGINES
+from fanout import DEFAULT_MAX_DESTINATIONS, DEFAULT_GLOBAL_IN_FLIGHT, DEFAULT_DESTINATION_IN_FLIGHT
+from history import HistoryStore
+from journal import JournalError
+from keboola_client import get_client
+from metrics import get_metrics, summary_rows, METRICS_JSON_PATH, METRICS_PROMETHEUS_PATH
+from planner import plan_destinations
+from preflight import preflight_destinations, plan_component_ids, excluded_summary
+from source_snapshot import SourceSnapshot
+from streaming import stream_destinations
+
+
+def config_key(value):
+    # --config value, checked here so a malformed one is a usage error rather than a traceback
+    component_id, _, config_id = value.partition('/')
+    if not component_id.strip() or not config_id.strip():
+        raise argparse.ArgumentTypeError(f"expected COMPONENT_ID/CONFIG_ID, got '{value}'")
+    return value
+
+
+def run_number(value):
+    if value == 'last':
+        return value
+    try:
+        run = int(value)
+    except ValueError:
+        run = 0
+    if run <= 0:
+        raise argparse.ArgumentTypeError(f"expected a history run number or 'last', got '{value}'")
+    return run
+
+
+def positive_int(value):
+    # Concurrency limits; 0 would block every request and a negative one cannot make a semaphore
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number <= 0:
+        raise argparse.ArgumentTypeError(f"expected a positive integer, got '{value}'")
+    return number
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m app.migrate_cli', description='Migrate Keboola project configurations without the Streamlit UI.')
+    parser.add_argument('--source', help='Source project name from the source config file (not needed with --from-snapshot)')
+    parser.add_argument('--dest', action='append', help='Destination project name, repeat for several projects')
+    parser.add_argument('--source-config', default=os.path.join(script_dir, 'config_source.json'))
+    parser.add_argument('--dest-config', default=os.path.join(script_dir, 'config_destination.json'))
+
+    selection = parser.add_mutually_exclusive_group()
+    selection.add_argument('--keep', help='Comma separated component IDs to migrate')
+    selection.add_argument('--skip', help='Comma separated component IDs not to migrate')
+    parser.add_argument('--config', action='append', default=[], type=config_key, metavar='COMPONENT_ID/CONFIG_ID', help='Migrate only these configurations, repeatable')
+    parser.add_argument('--include-shared-code', action='store_true', help='Also migrate shared code rows referenced by the selected transformations')
+    parser.add_argument('--rerun-failed', nargs='?', const='last', type=run_number, metavar='RUN',
+                        help='Migrate only the configurations that failed in the last run (or the given history run number) to the projects they failed in')
+
+    parser.add_argument('--from-snapshot', help='Start from a saved source snapshot instead of reading the source project')
+    parser.add_argument('--save-snapshot', help='Save the loaded source snapshot to this file')
+    parser.add_argument('--stream', action='store_true',
+                        help='Write configurations while the source is still being read, without loading the whole source first; all destinations run at once')
+
+    parser.add_argument('--branch', default='default')
+    parser.add_argument('--incremental', action='store_true', help='Skip configurations and rows that already match the destination')
+    parser.add_argument('--resume', action='store_true', help='Continue the previous run of the same selection and destinations')
+    parser.add_argument('--engine', choices=ENGINES, default='threads',
+                        help='threads: a worker thread per in-flight configuration; asyncio: coroutines on one event loop, for thousands of requests in flight (needs aiohttp)')
+    parser.add_argument('--max-destinations', type=positive_int, default=DEFAULT_MAX_DESTINATIONS)
+    parser.add_argument('--global-in-flight', type=positive_int,
+                        help=f'Default: {DEFAULT_GLOBAL_IN_FLIGHT} with threads, {DEFAULT_ASYNC_GLOBAL_IN_FLIGHT} with asyncio')
+    parser.add_argument('--destination-in-flight', type=positive_int,
+                        help=f'Default: {DEFAULT_DESTINATION_IN_FLIGHT} with threads, {DEFAULT_ASYNC_DESTINATION_IN_FLIGHT} with asyncio')
+    parser.add_argument('--jsonl', action='store_true', help='Also write the run journal as log.jsonl')
+    parser.add_argument('--metrics-json', help=f'Per-endpoint request metrics of the run as JSON (default: {METRICS_JSON_PATH} next to the app)')
+    parser.add_argument('--metrics-prom', help=f'The same metrics in the Prometheus text format (default: {METRICS_PROMETHEUS_PATH} next to the app)')
+    parser.add_argument('--no-preflight', action='store_true', help='Do not check the destination tokens, branch and components before writing')
+    parser.add_argument('--plan', action='store_true', help='Only print what would be created, updated and skipped, the API calls and the estimated duration')
+    return parser.parse_args(argv)
+
+
+def split_ids(value):
+    return [item.strip() for item in value.split(',') if item.strip()] if value else None
+
+
+def config_projects(config_path, label, names):
+    # Projects of a config file, reported like the Streamlit page does when the file is missing
+    if not os.path.exists(config_path):
+        sys.exit(f'{label} config file not found: {config_path}')
+    try:
+        return find_projects(load_projects(config_path), names)
+    except ValueError as e:
+        sys.exit(f'{e} in {config_path}')
+
+
+def preflight(destinations, branch, component_ids, report, args):
+    # Destinations that pass the preflight, and summaries of those left out
+    if args.no_preflight:
+        return destinations, {}
+    healthy, excluded = preflight_destinations(destinations, branch, component_ids, report)
+    return healthy, {name: excluded_summary(name, reason) for name, reason in excluded.items()}
+
+
+def finish_run(summaries, started, report, args):
+    metrics = get_metrics()
+    snapshot = metrics.snapshot()
+    for row in summary_rows(snapshot):
+        report(f"{row['endpoint']}: {row['requests']} requests, {row['seconds']} s, avg {row['avg s']} s, p95 {row['p95 s']} s, "
+               f"statuses {row['statuses']}, {row['retries']} retries, {row['kB sent']} kB sent, {row['kB received']} kB received")
+    report(f"{snapshot['configs_per_second']} configurations/s, {snapshot['requests_per_second']} requests/s")
+    metrics.export(args.metrics_json, args.metrics_prom)
+    for host, limiter_stats in get_limiter_stats().items():
+        report(f"{host}: concurrency limit {limiter_stats['limit']}, retries {limiter_stats['retries'] or 'none'}")
+    report(f'Finished in {time.monotonic() - started:.1f} s')
+
+    failed = [name for name, summary in summaries.items() if summary['fails'] or summary['error']]
+    for name in failed:
+        summary = summaries[name]
+        report(f"{name}: {len(summary['fails'])} failed configurations" + (f", error: {summary['error']}" if summary['error'] else ''))
+    return 1 if failed else 0
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # Paths given on the command line are relative to where the command runs; logs and checkpoints live next to the app
+    snapshot_path = os.path.abspath(args.from_snapshot) if args.from_snapshot else None
+    save_snapshot_path = os.path.abspath(args.save_snapshot) if args.save_snapshot else None
+    source_config = os.path.abspath(args.source_config)
+    dest_config = os.path.abspath(args.dest_config)
+    args.metrics_json = os.path.abspath(args.metrics_json) if args.metrics_json else METRICS_JSON_PATH
+    args.metrics_prom = os.path.abspath(args.metrics_prom) if args.metrics_prom else METRICS_PROMETHEUS_PATH
+    os.chdir(script_dir)
+
+    if args.engine == 'asyncio' and not async_engine.is_available():
+        sys.exit('--engine asyncio needs the aiohttp package: pip install aiohttp')
+    if args.engine == 'asyncio' and args.stream:
+        sys.exit('--stream runs on the threads engine only')
+    if args.global_in_flight is None:
+        args.global_in_flight = DEFAULT_ASYNC_GLOBAL_IN_FLIGHT if args.engine == 'asyncio' else DEFAULT_GLOBAL_IN_FLIGHT
+    if args.destination_in_flight is None:
+        args.destination_in_flight = DEFAULT_ASYNC_DESTINATION_IN_FLIGHT if args.engine == 'asyncio' else DEFAULT_DESTINATION_IN_FLIGHT
+
+    output_lock = threading.Lock()
+
+    def report(message):
+        with output_lock:
+            print(message, flush=True)
+
+    def on_event(event):
+        destination = event['destination']
+        if event['type'] == 'destination_started':
+            total = f"{event['total']} configurations" if event['total'] is not None else 'streaming configurations'
+            resumed = f", {event['resumed']} already completed" if event['resumed'] else ''
+            report(f"[{destination}] started: {total}{resumed}")
+        elif event['type'] == 'config_done':
+            config = event['config']
+            status = 'OK' if event['success'] else 'FAILED'
+            progress = f"{event['done']}/{event['total']}" if event['total'] is not None else str(event['done'])
+            report(f"[{destination}] {progress} {status} {config['component_id']} {config['name']}")
+        elif event['type'] == 'destination_finished':
+            resumed = f", {event['resumed']} already completed" if event['resumed'] else ''
+            report(f"[{destination}] finished: {event['migrated']} migrated, {event['failed']} failed{resumed}" + (f", error: {event['error']}" if event['error'] else ''))
+
+    if args.rerun_failed:
+        if snapshot_path or args.keep or args.skip or args.config:
+            sys.exit('--rerun-failed picks the configurations itself and cannot be combined with --from-snapshot, --keep, --skip or --config')
+        run = None if args.rerun_failed == 'last' else args.rerun_failed
+        failed = HistoryStore().failed_configs(run, args.source)
+        if not failed:
+            report('No failed configurations in the migration history')
+            return 0
+        sources = {item['source_project'] for item in failed}
+        if len(sources) > 1 or (args.source and args.source not in sources):
+            sys.exit(f"The failed configurations come from {', '.join(sorted(sources))}, pass the run with --source")
+        args.source = sources.pop()
+        args.dest = args.dest or sorted({item['destination_project'] for item in failed})
+        args.config = sorted({f"{item['component_id']}/{item['config_id']}" for item in failed})
+        # A config failed in one project may have landed in another; incremental mode leaves those untouched
+        args.incremental = True
+        report(f"Migrating {len(args.config)} failed configurations from {args.source} to {', '.join(args.dest)} again")
+    elif not args.dest:
+        sys.exit('--dest is required')
+
+    started = time.monotonic()
+    get_metrics().reset()
+    if args.stream:
+        if snapshot_path or save_snapshot_path or args.plan:
+            sys.exit('--stream cannot be combined with --from-snapshot, --save-snapshot or --plan')
+        if not args.source:
+            sys.exit('--source is required with --stream')
+        source_project = config_projects(source_config, 'Source', [args.source])[0]
+        source_client = get_client(source_project['url'], source_project['token'])
+        destinations = config_projects(dest_config, 'Destination', args.dest)
+        skip, keep = split_ids(args.skip), split_ids(args.keep)
+        selected_configs = [[item.split('/', 1)[0], '', item.split('/', 1)[1]] for item in args.config] or None
+        run_id = make_stream_run_id(source_project['name'], skip, keep, selected_configs, args.include_shared_code, [project['name'] for project in destinations])
+        # The components are only known once streamed, so only the tokens and the branch are checked
+        destinations, excluded = preflight(destinations, args.branch, None, report, args)
+        report(f'Run {run_id}: streaming {source_project["name"]} to {len(destinations)} projects')
+        summaries = stream_destinations(source_client, source_project['name'], destinations, skip, keep, selected_configs, args.include_shared_code,
+                                        args.branch, args.global_in_flight, args.destination_in_flight, on_event, args.incremental,
+                                        'log.jsonl' if args.jsonl else None, run_id, args.resume, report=report)
+        return finish_run(dict(summaries, **excluded), started, report, args)
+
+    if snapshot_path:
+        snapshot = SourceSnapshot.load(snapshot_path)
+        report(f'Loaded source snapshot of {snapshot.source_name} created at {snapshot.created_at}: {len(snapshot)} configurations')
+    else:
+        if not args.source:
+            sys.exit('--source is required unless --from-snapshot is given')
+        source_project = config_projects(source_config, 'Source', [args.source])[0]
+        selected_configs = [[item.split('/', 1)[0], '', item.split('/', 1)[1]] for item in args.config] or None
+        if args.engine == 'asyncio':
+            snapshot = async_engine.load_source_snapshot(source_project, split_ids(args.skip), split_ids(args.keep), selected_configs,
+                                                         args.include_shared_code, report, args.global_in_flight)
+        else:
+            source_client = get_client(source_project['url'], source_project['token'])
+            snapshot = load_source_snapshot(source_client, source_project['name'], split_ids(args.skip), split_ids(args.keep), selected_configs,
+                                            args.include_shared_code, report)
+        report(f'Loaded {len(snapshot)} configurations and {len(snapshot.shared_code_configs)} shared codes from {snapshot.source_name}')
+        if save_snapshot_path:
+            snapshot.save(save_snapshot_path)
+            report(f'Source snapshot saved to {save_snapshot_path}')
+
+    destinations = config_projects(dest_config, 'Destination', args.dest)
+    run_id = make_run_id(snapshot, [project['name'] for project in destinations])
+
+    if args.plan:
+        checkpoints = CheckpointStore() if args.resume and os.path.exists(CHECKPOINT_PATH) else None
+        plans, estimated_seconds = plan_destinations(snapshot, destinations, args.branch, args.incremental, args.max_destinations, args.global_in_flight,
+                                                     args.destination_in_flight, checkpoints, run_id, args.resume)
+        for plan in plans.values():
+            report(f"[{plan['destination']}] configs: {plan['configs_create']} create, {plan['configs_update']} update, {plan['configs_skip']} skip; "
+                   f"rows: {plan['rows_create']} create, {plan['rows_update']} update, {plan['rows_skip']} skip; "
+                   f"{plan['calls']} API calls, ~{plan['estimated_seconds']:.0f} s at {plan['request_latency']:.3f} s per call"
+                   + ('' if plan['latency_measured'] else ' (default latency)'))
+            for item in plan['items']:
+                report(f"    {item['action']:<6} {item['component_id']} {item['config_id']} {item['name']} "
+                       f"(rows {item['rows_create']}/{item['rows_update']}/{item['rows_skip']} create/update/skip)")
+        report(f'Run {run_id}: estimated duration {datetime.timedelta(seconds=int(estimated_seconds))}, nothing was written')
+        return 0
+
+    destinations, excluded = preflight(destinations, args.branch, plan_component_ids(snapshot), report, args)
+    report(f'Run {run_id}: migrating to {len(destinations)} projects, up to {args.max_destinations} at once, {args.engine} engine')
+
+    migrate_destinations = get_migrate_destinations(args.engine)
+    summaries = migrate_destinations(snapshot, destinations, args.branch, args.max_destinations, args.global_in_flight,
+                                     args.destination_in_flight, on_event, args.incremental, 'log.jsonl' if args.jsonl else None, run_id, args.resume)
+
+    return finish_run(dict(summaries, **excluded), started, report, args)
+
+
+if __name__ == '__main__':
+    try:
+        sys.exit(main())
+    except JournalError as e:
+        sys.exit(str(e))
@@ -0,0 +1,89 @@
+import streamlit as st
+import datetime
+import os
+import time
+from checkpoint import make_run_id
+from engine import load_projects, find_projects, load_source_snapshot
+from fanout import migrate_destinations
+from history import HistoryStore
+from journal import CSV_PATH
+from keboola_client import get_client
+
+def main():
+    st.title("Migration History")
+
+    # Same working directory as the migration page, so history.db and log.csv are the ones next to the app
+    app_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    os.chdir(app_dir)
+    history = HistoryStore()
+
+    st.sidebar.title("History")
+    if st.sidebar.button("Import log.csv"):
+        with st.spinner("Importing log.csv..."):
+            imported = history.import_csv(CSV_PATH)
+        st.sidebar.write(f"Imported {imported} new records")
+
+    # Filters, each served by an index of the history store
+    st.sidebar.title("Filters")
+    source = st.sidebar.selectbox("Source project", [""] + history.distinct('source_project'))
+    destination = st.sidebar.selectbox("Destination project", [""] + history.distinct('destination_project'))
+    status = st.sidebar.selectbox("Status", [""] + history.distinct('status'))
+    component_id = st.sidebar.text_input("Component ID")
+    config_id = st.sidebar.text_input("Configuration ID")
+    search = st.sidebar.text_input("Name or message contains")
+    use_since = st.sidebar.checkbox("Only since a date", value=False)
+    since = st.sidebar.date_input("Since", value=datetime.date.today() - datetime.timedelta(days=30)) if use_since else None
+    limit = st.sidebar.number_input("Max rows", min_value=10, max_value=100000, value=1000)
+
+    started = time.monotonic()
+    rows = history.query(source, destination, component_id.strip(), config_id.strip(), status, since=since, search=search.strip(), limit=limit)
+    st.write(f"{len(rows)} records in {(time.monotonic() - started) * 1000:.0f} ms")
+    st.dataframe(rows)
+
+    # When a config last landed in a project
+    if component_id.strip() and config_id.strip() and destination:
+        last = history.last_success(component_id.strip(), config_id.strip(), destination)
+        if last:
+            st.write(f"Last successful migration of **{component_id}/{config_id}** to **{destination}**: {last['migrated_at']} ({last['status']})")
+        else:
+            st.write(f"**{component_id}/{config_id}** was never migrated to **{destination}** successfully")
+
+    st.subheader("Runs")
+    runs = history.runs()
+    st.table([{key: run[key] for key in ('id', 'run_id', 'kind', 'started_at', 'finished_at', 'configs', 'failed')} for run in runs])
+
+    # Bulk re-run of the configs that failed, each to the projects it failed in
+    st.subheader("Re-run failed configurations")
+    migration_runs = [run['id'] for run in runs if run['kind'] == 'run']
+    if not migration_runs:
+        st.write("No migration runs recorded yet")
+        return
+    run = st.selectbox("Run", migration_runs)
+    failed = history.failed_configs(run)
+    if not failed:
+        st.write(f"Nothing failed in run {run}")
+        return
+    st.table(failed)
+
+    sources = sorted({item['source_project'] for item in failed})
+    if len(sources) > 1:
+        st.warning(f"Run {run} migrated from several source projects ({', '.join(sources)}), re-run them from the migration page")
+        return
+
+    if st.button(f"Re-run {len(failed)} failed configurations"):
+        source_project = find_projects(load_projects('config_source.json'), sources)[0]
+        destinations = find_projects(load_projects('config_destination.json'), sorted({item['destination_project'] for item in failed}))
+        selected_configs = sorted({(item['component_id'], '', item['config_id']) for item in failed})
+        with st.spinner("Migrating failed configurations..."):
+            source_client = get_client(source_project['url'], source_project['token'])
+            snapshot = load_source_snapshot(source_client, source_project['name'], selected_configs=[list(config) for config in selected_configs])
+            # Incremental, so configs that landed in some of the projects are not written there again
+            summaries = migrate_destinations(snapshot, destinations, incremental=True, run_id=make_run_id(snapshot, [project['name'] for project in destinations]))
+        for name, summary in summaries.items():
+            if summary['error']:
+                st.error(f"{name}: {summary['error']}")
+            else:
+                st.write(f"**{name}**: {summary['migrated']} migrated, {summary['failed']} failed")
+
+if __name__ == "__main__":
+    main()
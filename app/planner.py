@@ -0,0 +1,132 @@
+import collections
+import concurrent.futures
+import csv
+import os
+import statistics
+from config_migrator import plan_config_writes
+from destination_index import load_destination_index
+from journal import CSV_PATH
+from keboola_client import get_client
+from metadata import metadata_key
+
+# Used when log.csv holds no timed requests yet
+DEFAULT_REQUEST_LATENCY = 0.3
+# Only the most recent journal records describe the current stack and network
+LATENCY_SAMPLE_SIZE = 2000
+
+
+def measure_request_latencies(csv_path=CSV_PATH):
+    # Median seconds per request over recent journal records: overall, and per destination project.
+    # One pass over log.csv serves every destination of a plan.
+    if not os.path.exists(csv_path):
+        return None, {}
+    samples = collections.deque(maxlen=LATENCY_SAMPLE_SIZE)
+    destination_samples = collections.defaultdict(lambda: collections.deque(maxlen=LATENCY_SAMPLE_SIZE))
+    with open(csv_path, mode='r', newline='', encoding='utf-8-sig') as file:
+        for record in csv.DictReader(file):
+            try:
+                duration_ms = float(record.get('DurationMs') or 0)
+                requests_made = int(record.get('Requests') or 0)
+            except ValueError:
+                continue
+            if duration_ms <= 0 or requests_made <= 0:
+                continue
+            latency = duration_ms / 1000 / requests_made
+            samples.append(latency)
+            destination_samples[record.get('DestinationProject')].append(latency)
+
+    overall = statistics.median(samples) if samples else None
+    return overall, {name: statistics.median(chosen) for name, chosen in destination_samples.items()}
+
+
+def measure_request_latency(csv_path=CSV_PATH, destination_name=None):
+    # Median seconds per request, preferring records of the given destination
+    overall, by_destination = measure_request_latencies(csv_path)
+    return by_destination.get(destination_name, overall)
+
+
+def plan_latency(measured):
+    # (latency, measured) for plan_destination; the default stands in when log.csv has no timed records
+    return (measured, True) if measured is not None else (DEFAULT_REQUEST_LATENCY, False)
+
+
+def plan_config(config, index, incremental, checkpoint=None, metadata=None):
+    config_state, rows_to_write, counts = plan_config_writes(config, index, incremental, checkpoint)
+    rows = collections.Counter(state for _, state in rows_to_write)
+    rows['skip'] = counts['rows_unchanged'] + counts['rows_resumed']
+
+    if config_state == 'unchanged':
+        config_action = 'skip'
+        calls = 0
+    else:
+        config_action = 'create' if config_state == 'created' else 'update'
+        calls = 1
+        # All metadata keys of the config go in one write
+        if metadata:
+            calls += 1
+    calls += len(rows_to_write)
+
+    return {
+        'component_id': config['component_id'],
+        'config_id': config['id'],
+        'name': config['name'],
+        'action': config_action,
+        'rows_create': rows['created'],
+        'rows_update': rows['updated'],
+        'rows_skip': rows['skip'],
+        'calls': calls,
+    }
+
+
+def plan_destination(snapshot, dest_project, BRANCH_DEST='default', incremental=False, checkpoint=None, concurrency=1, latency=None,
+                     latency_measured=True):
+    # Read-only: one bulk listing of the destination branch, nothing is written
+    dest_client = get_client(dest_project['url'], dest_project['token'])
+    index = load_destination_index(dest_client, BRANCH_DEST)
+
+    items = []
+    for config in snapshot.shared_code_configs + snapshot.configs:
+        if checkpoint and checkpoint.is_done(config['component_id'], config['id']):
+            continue
+        items.append(plan_config(config, index, incremental, checkpoint, snapshot.metadata.get(metadata_key(config['component_id'], config['id']))))
+
+    # plan_destinations passes the latency of every destination from one read of log.csv; a single plan measures its own
+    if latency is None:
+        latency = measure_request_latency(destination_name=dest_project['name'])
+        latency_measured = latency is not None
+    request_latency = latency if latency is not None else DEFAULT_REQUEST_LATENCY
+    # The destination listing itself is one call
+    calls = 1 + sum(item['calls'] for item in items)
+    actions = collections.Counter(item['action'] for item in items)
+    return {
+        'destination': dest_project['name'],
+        'configs_create': actions['create'],
+        'configs_update': actions['update'],
+        'configs_skip': actions['skip'],
+        'rows_create': sum(item['rows_create'] for item in items),
+        'rows_update': sum(item['rows_update'] for item in items),
+        'rows_skip': sum(item['rows_skip'] for item in items),
+        'calls': calls,
+        'request_latency': request_latency,
+        'latency_measured': latency_measured,
+        'estimated_seconds': calls * request_latency / max(1, concurrency),
+        'items': items,
+    }
+
+
+def plan_destinations(snapshot, destinations, BRANCH_DEST='default', incremental=False, max_destinations=1, global_in_flight=1, destination_in_flight=1,
+                      checkpoints=None, run_id=None, resume=False):
+    # Dry run of migrate_destinations: what each destination would get, how many calls that is and roughly how long it takes
+    concurrency = max(1, min(destination_in_flight, global_in_flight // max(1, min(max_destinations, len(destinations)))))
+    overall_latency, destination_latencies = measure_request_latencies()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, max_destinations)) as executor:
+        futures = {dest_project['name']: executor.submit(plan_destination, snapshot, dest_project, BRANCH_DEST, incremental,
+                                                         checkpoints.scope(run_id, snapshot.source_name, dest_project['name'], resume) if checkpoints and resume else None,
+                                                         concurrency, *plan_latency(destination_latencies.get(dest_project['name'], overall_latency)))
+                   for dest_project in destinations}
+        plans = {name: future.result() for name, future in futures.items()}
+
+    # Destinations run in waves of max_destinations, each wave as long as its slowest destination
+    durations = sorted((plan['estimated_seconds'] for plan in plans.values()), reverse=True)
+    estimated_seconds = sum(durations[i] for i in range(0, len(durations), max(1, max_destinations)))
+    return plans, estimated_seconds
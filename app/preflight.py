@@ -0,0 +1,96 @@
+import concurrent.futures
+from fanout import destination_summary
+from json_codec import response_json
+from keboola_client import get_client
+
+# Checks every destination project before anything is written to it: a project with a bad token, a missing branch or
+# a component its stack does not offer would otherwise fail every config one write at a time.
+PREFLIGHT_TIMEOUT = (5, 30)
+# Project roles that cannot write configurations
+READ_ONLY_ROLES = ('readOnly',)
+
+
+def plan_component_ids(snapshot):
+    return sorted({config['component_id'] for config in snapshot.shared_code_configs + snapshot.configs})
+
+
+def check_token(client):
+    # Reason the token cannot migrate configurations, or None; also returns the verified token
+    response = client.get('v2/storage/tokens/verify', timeout=PREFLIGHT_TIMEOUT)
+    if response.status_code in (401, 403):
+        return 'invalid or expired token', None
+    response.raise_for_status()
+    token = response_json(response)
+    role = (token.get('admin') or {}).get('role')
+    if role in READ_ONLY_ROLES:
+        return f'token of a {role} user cannot write configurations', token
+    return None, token
+
+
+def check_branch(client, BRANCH_DEST):
+    response = client.get('v2/storage/dev-branches', timeout=PREFLIGHT_TIMEOUT)
+    response.raise_for_status()
+    branches = response_json(response)
+    if BRANCH_DEST == 'default':
+        found = any(branch.get('isDefault') for branch in branches)
+    else:
+        found = any(str(branch.get('id')) == str(BRANCH_DEST) for branch in branches)
+    return None if found else f'branch {BRANCH_DEST} does not exist'
+
+
+def check_components(client, token, component_ids):
+    # Components of the plan that the stack does not offer or the token may not use
+    response = client.get('v2/storage', timeout=PREFLIGHT_TIMEOUT)
+    response.raise_for_status()
+    available = {component['id'] for component in response_json(response).get('components', [])}
+    missing = [component_id for component_id in component_ids if component_id not in available]
+    if missing:
+        return f"components not available: {', '.join(missing)}"
+    # Tokens limited to some components list them in componentAccess
+    if token and token.get('componentAccess') is not None and not token.get('isMasterToken'):
+        denied = [component_id for component_id in component_ids if component_id not in token['componentAccess']]
+        if denied:
+            return f"token has no access to components: {', '.join(denied)}"
+    return None
+
+
+def check_destination(dest_project, BRANCH_DEST='default', component_ids=None):
+    # Reason the destination cannot be migrated to, or None when it is ready; a bad token makes the other checks pointless
+    client = get_client(dest_project['url'], dest_project['token'])
+    try:
+        reason, token = check_token(client)
+        if reason:
+            return reason
+        reason = check_branch(client, BRANCH_DEST)
+        if reason:
+            return reason
+        if component_ids:
+            return check_components(client, token, component_ids)
+        return None
+    except Exception as e:
+        return f'preflight failed: {e}'
+
+
+def preflight_destinations(destinations, BRANCH_DEST='default', component_ids=None, report=None):
+    # Checks all destinations at once. Returns the healthy ones and {name: reason} for the excluded ones.
+    # Without component_ids (e.g. when streaming) component availability is not checked.
+    report = report or (lambda message: None)
+    if not destinations:
+        return [], {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(destinations)) as executor:
+        reasons = list(executor.map(lambda dest_project: check_destination(dest_project, BRANCH_DEST, component_ids), destinations))
+
+    healthy = []
+    excluded = {}
+    for dest_project, reason in zip(destinations, reasons):
+        if reason:
+            excluded[dest_project['name']] = reason
+            report(f"{dest_project['name']}: excluded, {reason}")
+        else:
+            healthy.append(dest_project)
+    return healthy, excluded
+
+
+def excluded_summary(destination_name, reason):
+    # Summary of a destination left out by the preflight, in the shape the fan-out returns
+    return destination_summary(destination_name, error=f'preflight: {reason}')
@@ -0,0 +1,102 @@
+import datetime
+import gzip
+import json
+from dataclasses import dataclass, field
+from dependency_graph import config_key
+
+SNAPSHOT_VERSION = 2
+SHARED_CODE_COMPONENTS = ('keboola.snowflake-transformation', 'keboola.python-transformation-v2')
+
+
+@dataclass(frozen=True)
+class SourceSnapshot:
+    # Source configurations read once per run and consumed by every destination migration.
+    # Consumers must treat the configs as read-only; filtering produces new dicts.
+    source_name: str
+    source_url: str
+    configs: tuple
+    shared_code_configs: tuple = ()
+    created_at: str = ''
+    # Relevant configuration metadata per 'component_id/config_id', prefetched with the configs
+    metadata: dict = field(default_factory=dict, compare=False)
+
+    def __len__(self):
+        return len(self.configs)
+
+    def save(self, path):
+        payload = {
+            'version': SNAPSHOT_VERSION,
+            'source_name': self.source_name,
+            'source_url': self.source_url,
+            'created_at': self.created_at,
+            'configs': list(self.configs),
+            'shared_code_configs': list(self.shared_code_configs),
+            'metadata': self.metadata,
+        }
+        with gzip.open(path, 'wt', encoding='utf-8') as file:
+            json.dump(payload, file)
+
+    @classmethod
+    def load(cls, path):
+        with gzip.open(path, 'rt', encoding='utf-8') as file:
+            payload = json.load(file)
+        # Version 1 snapshots have no metadata, they still migrate without it
+        if payload.get('version') not in (1, SNAPSHOT_VERSION):
+            raise ValueError(f"Unsupported snapshot version: {payload.get('version')}")
+        return cls(
+            source_name=payload['source_name'],
+            source_url=payload['source_url'],
+            configs=tuple(payload['configs']),
+            shared_code_configs=tuple(payload['shared_code_configs']),
+            created_at=payload['created_at'],
+            metadata=payload.get('metadata', {}),
+        )
+
+
+def get_shared_code_row_ids(configs):
+    # Shared code rows referenced by the Python and Snowflake transformations, per transformation component
+    shared_code_row_ids = {component_id: set() for component_id in SHARED_CODE_COMPONENTS}
+    for config in configs:
+        component_id = config.get('component_id')
+        if component_id in shared_code_row_ids:
+            shared_code_row_ids[component_id].update((config.get('configuration') or {}).get('shared_code_row_ids', []))
+    return shared_code_row_ids
+
+
+def filter_shared_code_configs(shared_code_configs, shared_code_row_ids):
+    filtered = []
+    for shared_code in shared_code_configs:
+        component_id = (shared_code.get('configuration') or {}).get('componentId')
+        row_ids = shared_code_row_ids.get(component_id)
+        if row_ids is None:
+            filtered.append(shared_code)
+            continue
+        filtered.append(dict(shared_code, rows=[row for row in shared_code['rows'] if row['id'] in row_ids]))
+    return filtered
+
+
+def unique_configs(configs):
+    # A config selected twice (e.g. a variables config added for two transformations) is migrated once
+    seen = set()
+    unique = []
+    for config in configs:
+        key = config_key(config)
+        if key not in seen:
+            seen.add(key)
+            unique.append(config)
+    return unique
+
+
+def build_source_snapshot(source_name, source_url, configs, shared_code_configs=None, metadata=None):
+    configs = unique_configs(configs)
+    shared_code_configs = shared_code_configs or []
+    if shared_code_configs:
+        shared_code_configs = filter_shared_code_configs(shared_code_configs, get_shared_code_row_ids(configs))
+    return SourceSnapshot(
+        source_name=source_name,
+        source_url=source_url,
+        configs=tuple(configs),
+        shared_code_configs=tuple(shared_code_configs),
+        created_at=datetime.datetime.now().replace(microsecond=0).isoformat(),
+        metadata=metadata or {},
+    )
@@ -0,0 +1,271 @@
+import concurrent.futures
+import contextlib
+import itertools
+import queue
+import threading
+from requests.exceptions import ConnectionError, Timeout
+from checkpoint import CheckpointStore, CHECKPOINT_PATH
+from config_migrator import iter_keboola_configs, migrate_config, dependency_failed, failed_result, ConfigSchedule
+from dependency_graph import config_key, config_references, SHARED_CODE_COMPONENT
+from destination_index import load_destination_index
+from engine import load_shared_code_configs
+from fanout import DEFAULT_GLOBAL_IN_FLIGHT, DEFAULT_DESTINATION_IN_FLIGHT, destination_summary
+from history import HistoryStore, HISTORY_PATH
+from journal import RunJournal
+from keboola_client import get_client
+from metadata import metadata_key, prefetch_metadata, METADATA_WORKERS
+from source_snapshot import get_shared_code_row_ids, filter_shared_code_configs, SHARED_CODE_COMPONENTS
+
+# Streaming mode: source configs are handed to the destination writers while the source is still being read.
+# Each destination gets a bounded stream; when a destination falls behind, its full stream blocks the reader,
+# so at most STREAM_QUEUE_SIZE configs per destination (plus the ones being written) are held in memory.
+STREAM_QUEUE_SIZE = 32
+# Configs read before their metadata is fetched in one concurrent batch
+STREAM_CHUNK_SIZE = METADATA_WORKERS
+STREAM_POLL_INTERVAL = 0.05
+STREAM_END = object()
+
+
+class ConfigStream:
+    # Bounded hand-over of (config, metadata) pairs from the source reader to one destination
+
+    def __init__(self, maxsize=STREAM_QUEUE_SIZE):
+        self._queue = queue.Queue(maxsize)
+        self._closed = threading.Event()
+
+    def put(self, item):
+        # Blocks while the stream is full; returns right away once the destination stopped consuming
+        while not self._closed.is_set():
+            try:
+                self._queue.put(item, timeout=STREAM_POLL_INTERVAL)
+                return
+            except queue.Full:
+                continue
+
+    def get(self, block=True):
+        return self._queue.get(block=block)
+
+    def close(self):
+        self._closed.set()
+
+
+def read_source_stream(source_client, streams, skip=None, keep=None, selected_configs=None, include_shared_code=False, report=None):
+    # Producer: reads the source once and puts every config with its metadata into every destination stream.
+    # Shared codes are trimmed to the rows the streamed transformations reference, so they are read last.
+    shared_code_row_ids = {component_id: set() for component_id in SHARED_CODE_COMPONENTS}
+
+    def publish(configs):
+        metadata = prefetch_metadata(source_client, configs)
+        for config in configs:
+            item = (config, metadata.get(metadata_key(config['component_id'], config['id'])))
+            for stream in streams:
+                stream.put(item)
+
+    try:
+        configs = iter_keboola_configs(source_client, skip, keep, selected_configs, report)
+        while True:
+            chunk = list(itertools.islice(configs, STREAM_CHUNK_SIZE))
+            if not chunk:
+                break
+            for component_id, row_ids in get_shared_code_row_ids(chunk).items():
+                shared_code_row_ids[component_id].update(row_ids)
+            publish(chunk)
+
+        if include_shared_code:
+            shared_code_configs = load_shared_code_configs(source_client)
+            if shared_code_configs:
+                publish(filter_shared_code_configs(shared_code_configs, shared_code_row_ids))
+    finally:
+        for stream in streams:
+            stream.put(STREAM_END)
+
+
+class StreamSchedule(ConfigSchedule):
+    # ConfigSchedule for configs that arrive one at a time. A config waits for referenced configs that arrived before it
+    # and have not landed yet. With include_shared_code it also waits for the shared codes it references, which the reader
+    # only publishes at the end; end() releases references that never arrive. Only configs still to land are held.
+
+    def __init__(self, on_progress=None, counts=None, journal=None, source_name=None, destination_name=None, include_shared_code=False):
+        super().__init__([], on_progress, counts, journal, source_name, destination_name)
+        # Messages go out through on_progress as configs finish, so they are not buffered
+        self.log_messages = None
+        self.include_shared_code = include_shared_code
+        self.seen = set()
+        self.metadata = {}
+
+    def add(self, config, metadata=None):
+        # Returns the config's key when it can start right away
+        key = config_key(config)
+        self.seen.add(key)
+        references = config_references(config) - {key}
+        self.configs[key] = config
+        self.metadata[key] = metadata
+
+        failed_dependencies = references & self.failed
+        if failed_dependencies:
+            success, messages, _ = dependency_failed(config, failed_dependencies, self.source_name, self.destination_name, self.journal)
+            self._finish(key, success, messages)
+            return self._release(key)
+
+        waiting = references & self.configs.keys()
+        if self.include_shared_code:
+            waiting |= {reference for reference in references if reference[0] == SHARED_CODE_COMPONENT and reference not in self.seen}
+        if not waiting:
+            return [key]
+        self.dependencies[key] = waiting
+        self.pending[key] = len(waiting)
+        for dependency in waiting:
+            self.dependents[dependency].add(key)
+        return []
+
+    def resume(self, config):
+        # Landed in an earlier attempt: it is not migrated again and nothing waits for it
+        key = config_key(config)
+        self.seen.add(key)
+        return self._release(key)
+
+    def end(self):
+        # The stream ended: shared codes still waited for are not in the source, so nothing holds their dependents back
+        ready = []
+        for key in [key for key in self.dependents if key not in self.seen]:
+            ready += self._release(key)
+        return ready
+
+    def _finish(self, key, success, messages):
+        super()._finish(key, success, messages)
+        del self.configs[key]
+        self.metadata.pop(key, None)
+        self.dependencies.pop(key, None)
+
+
+def migrate_config_stream(stream, dest_client, BRANCH_DEST, source_name, destination_name, on_progress=None, on_resumed=None, index=None,
+                          counts=None, incremental=False, journal=None, checkpoint=None, include_shared_code=False):
+    # Consumer: writes configs as they arrive, in the order StreamSchedule allows. Returns the failed configs.
+    schedule = StreamSchedule(on_progress, counts, journal, source_name, destination_name, include_shared_code)
+    futures = {}
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=dest_client.pool_size) as executor:
+
+        def submit(keys):
+            for key in keys:
+                future = executor.submit(migrate_config, schedule.config(key), dest_client, BRANCH_DEST, source_name, destination_name, index,
+                                         incremental, journal, checkpoint, schedule.metadata[key])
+                futures[future] = key
+
+        def accept(config, metadata):
+            if config_key(config) in schedule.seen:
+                return
+            if checkpoint and checkpoint.is_done(config['component_id'], config['id']):
+                if on_resumed:
+                    on_resumed(config)
+                submit(schedule.resume(config))
+            else:
+                submit(schedule.add(config, metadata))
+
+        exhausted = False
+        while not exhausted or futures:
+            # Configs are taken only while a worker is free, so a slow destination backs up into its stream and slows the reader
+            while not exhausted and len(futures) < dest_client.pool_size:
+                try:
+                    item = stream.get(block=not futures)
+                except queue.Empty:
+                    break
+                if item is STREAM_END:
+                    exhausted = True
+                    submit(schedule.end())
+                else:
+                    accept(*item)
+
+            if futures:
+                done, _ = concurrent.futures.wait(futures, timeout=STREAM_POLL_INTERVAL, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    key = futures.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as exc:
+                        result = failed_result(schedule.config(key), exc)
+                    submit(schedule.record(key, result))
+
+    return schedule.fails
+
+
+def stream_destination(stream, source_name, dest_project, BRANCH_DEST, global_limit, destination_in_flight, on_event, incremental=False, journal=None,
+                       checkpoint=None, include_shared_code=False):
+    # Same summary and events as fanout.migrate_destination, except that the total is only known once the source is read
+    destination_name = dest_project['name']
+    summary = destination_summary(destination_name)
+    lock = threading.Lock()
+
+    def progress(config, success, messages):
+        with lock:
+            summary['migrated' if success else 'failed'] += 1
+            done = summary['migrated'] + summary['failed']
+        on_event({'type': 'config_done', 'destination': destination_name, 'config': config, 'success': success,
+                  'messages': messages, 'done': done, 'total': None})
+
+    def resumed(config):
+        with lock:
+            summary['resumed'] += 1
+
+    on_event({'type': 'destination_started', 'destination': destination_name, 'total': None, 'resumed': 0})
+    try:
+        dest_client = get_client(dest_project['url'], dest_project['token'])
+        dest_client.set_limits(destination_in_flight, global_limit)
+        index = load_destination_index(dest_client, BRANCH_DEST)
+        summary['fails'] = migrate_config_stream(stream, dest_client, BRANCH_DEST, source_name, destination_name, on_progress=progress, on_resumed=resumed,
+                                                 index=index, counts=summary['counts'], incremental=incremental, journal=journal, checkpoint=checkpoint,
+                                                 include_shared_code=include_shared_code)
+    except Exception as e:
+        summary['error'] = str(e)
+        summary['connection_error'] = isinstance(e, (ConnectionError, Timeout))
+    finally:
+        # A destination that stopped early must not hold up the reader or the other destinations
+        stream.close()
+
+    summary['total'] = summary['migrated'] + summary['failed']
+    on_event(dict(summary, type='destination_finished'))
+    return summary
+
+
+def stream_destinations(source_client, source_name, destinations, skip=None, keep=None, selected_configs=None, include_shared_code=False,
+                        BRANCH_DEST='default', global_in_flight=DEFAULT_GLOBAL_IN_FLIGHT, destination_in_flight=DEFAULT_DESTINATION_IN_FLIGHT,
+                        on_event=None, incremental=False, jsonl_path=None, run_id=None, resume=False, checkpoint_path=CHECKPOINT_PATH,
+                        report=None, history_path=HISTORY_PATH):
+    # Reads the source and migrates every destination at the same time. All destinations consume one shared read,
+    # so they all run at once; the global in-flight limit still bounds the requests of the whole run.
+    on_event = on_event or (lambda event: None)
+    global_limit = threading.BoundedSemaphore(global_in_flight)
+    streams = [ConfigStream() for _ in destinations]
+
+    checkpoints = CheckpointStore(checkpoint_path) if run_id else None
+    if checkpoints and not resume:
+        checkpoints.reset(run_id)
+
+    summaries = {}
+    source_error = None
+    history = HistoryStore(history_path) if history_path else None
+    with RunJournal(jsonl_path=jsonl_path, history=history, run_id=run_id) as journal, checkpoints or contextlib.nullcontext(), \
+            concurrent.futures.ThreadPoolExecutor(max_workers=len(destinations) + 1) as executor:
+        reader = executor.submit(read_source_stream, source_client, streams, skip, keep, selected_configs, include_shared_code, report)
+        futures = {executor.submit(stream_destination, stream, source_name, dest_project, BRANCH_DEST, global_limit, destination_in_flight, on_event,
+                                   incremental, journal,
+                                   checkpoints.scope(run_id, source_name, dest_project['name'], resume) if checkpoints else None,
+                                   include_shared_code): dest_project
+                   for dest_project, stream in zip(destinations, streams)}
+
+        for future in concurrent.futures.as_completed(futures):
+            dest_project = futures[future]
+            try:
+                summaries[dest_project['name']] = future.result()
+            except Exception as exc:
+                summaries[dest_project['name']] = destination_summary(dest_project['name'], error=str(exc))
+        try:
+            reader.result()
+        except Exception as exc:
+            source_error = f'Reading the source project failed: {exc}'
+
+    # A failed read leaves every destination incomplete
+    if source_error:
+        for summary in summaries.values():
+            summary['error'] = summary['error'] or source_error
+    return summaries
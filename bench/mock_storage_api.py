@@ -0,0 +1,272 @@
+import argparse
+import gzip
+import json
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Local stand-in for the parts of the Keboola Storage API the migration uses. The source project is synthetic and generated
+# from the size options; every other token gets its own empty, in-memory destination project that the migration writes into.
+SOURCE_TOKEN = 'source'
+# Tokens starting with this are rejected, as an expired token would be
+INVALID_TOKEN_PREFIX = 'invalid'
+FOLDER_METADATA_KEY = 'KBC.configuration.folderName'
+
+INDEX_PATH = re.compile(r'^/v2/storage/?$')
+TOKEN_VERIFY_PATH = re.compile(r'^/v2/storage/tokens/verify$')
+DEV_BRANCHES_PATH = re.compile(r'^/v2/storage/dev-branches$')
+COMPONENTS_PATH = re.compile(r'^/v2/storage(?:/branch/[^/]+)?/components$')
+CONFIGS_PATH = re.compile(r'^/v2/storage(?:/branch/[^/]+)?/components/([^/]+)/configs$')
+CONFIG_PATH = re.compile(r'^/v2/storage(?:/branch/[^/]+)?/components/([^/]+)/configs/([^/]+)$')
+METADATA_PATH = re.compile(r'^/v2/storage(?:/branch/[^/]+)?/components/([^/]+)/configs/([^/]+)/metadata$')
+ROWS_PATH = re.compile(r'^/v2/storage(?:/branch/[^/]+)?/components/([^/]+)/configs/([^/]+)/rows$')
+ROW_PATH = re.compile(r'^/v2/storage(?:/branch/[^/]+)?/components/([^/]+)/configs/([^/]+)/rows/([^/]+)$')
+
+
+def build_source_project(components, configs, rows, payload_bytes):
+    # configs are spread evenly over the components; every config and row carries payload_bytes of configuration
+    payload = 'x' * payload_bytes
+    project = {f'bench.component-{index}': {} for index in range(components)}
+    component_ids = list(project)
+    for index in range(configs):
+        config_id = str(100000 + index)
+        project[component_ids[index % components]][config_id] = {
+            'id': config_id,
+            'name': f'Benchmark configuration {index}',
+            'description': f'Synthetic configuration {index}',
+            'configuration': {'parameters': {'index': index, 'payload': payload}},
+            'rows': [{'id': f'{config_id}-{row}', 'name': f'Row {row}', 'description': '',
+                      'configuration': {'parameters': {'row': row, 'payload': payload}}} for row in range(rows)],
+        }
+    return project
+
+
+class MockStorageAPI:
+
+    def __init__(self, source_project, latency_ms=0, jitter_ms=0, rate_429=0.0, rate_5xx=0.0, retry_after=0.5, seed=None):
+        self.projects = {SOURCE_TOKEN: source_project}
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.rate_429 = rate_429
+        self.rate_5xx = rate_5xx
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.stats = {'requests': 0, 'injected_429': 0, 'injected_5xx': 0}
+        self.lock = threading.Lock()
+
+    def project(self, token):
+        with self.lock:
+            return self.projects.setdefault(token, {})
+
+    def fault(self):
+        # Injected faults are decided before the request is applied, so a retried write never lands twice
+        with self.lock:
+            self.stats['requests'] += 1
+            draw = self.random.random()
+            delay = self.latency + self.random.uniform(0, self.jitter)
+            if draw < self.rate_429:
+                self.stats['injected_429'] += 1
+                return delay, 429
+            if draw < self.rate_429 + self.rate_5xx:
+                self.stats['injected_5xx'] += 1
+                return delay, self.random.choice((500, 502, 503))
+            return delay, None
+
+
+def listing(config, include):
+    item = {'id': config['id'], 'name': config['name'], 'description': config['description']}
+    if 'configuration' in include:
+        item['configuration'] = config['configuration']
+    if 'rows' in include:
+        item['rows'] = config['rows']
+    return item
+
+
+def make_handler(api):
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def send_json(self, status, payload, headers=None):
+            body = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def read_body(self):
+            raw = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+            if self.headers.get('Content-Encoding') == 'gzip':
+                raw = gzip.decompress(raw)
+            if 'json' in self.headers.get('Content-Type', ''):
+                return json.loads(raw or b'{}')
+            return {key: values[0] for key, values in parse_qs(raw.decode('utf-8')).items()}
+
+        def handle_request(self, method):
+            url = urlparse(self.path)
+            if url.path == '/bench/stats':
+                with api.lock:
+                    return self.send_json(200, dict(api.stats))
+
+            body = self.read_body() if method in ('POST', 'PUT') else None
+            delay, fault = api.fault()
+            time.sleep(delay)
+            if fault == 429:
+                return self.send_json(429, {'error': 'Too many requests'}, {'Retry-After': str(api.retry_after)})
+            if fault:
+                return self.send_json(fault, {'error': 'Injected server error'})
+
+            token = self.headers.get('X-StorageApi-Token', '')
+            if token.startswith(INVALID_TOKEN_PREFIX):
+                return self.send_json(401, {'error': 'Invalid access token'})
+            project = api.project(token)
+            route = self.route(method, url.path)
+            if route is None:
+                return self.send_json(404, {'error': f'Unknown endpoint {method} {url.path}'})
+            status, payload = route(project, body, parse_qs(url.query))
+            self.send_json(status, payload)
+
+        def route(self, method, path):
+            for pattern, methods in (
+                (INDEX_PATH, {'GET': self.index}),
+                (TOKEN_VERIFY_PATH, {'GET': self.verify_token}),
+                (DEV_BRANCHES_PATH, {'GET': self.list_branches}),
+                (COMPONENTS_PATH, {'GET': self.list_components}),
+                (CONFIGS_PATH, {'GET': self.list_configs, 'POST': self.create_config}),
+                (CONFIG_PATH, {'GET': self.get_config, 'PUT': self.update_config}),
+                (METADATA_PATH, {'GET': self.get_metadata, 'POST': self.set_metadata}),
+                (ROWS_PATH, {'POST': self.create_row}),
+                (ROW_PATH, {'PUT': self.update_row}),
+            ):
+                match = pattern.match(path)
+                if match and method in methods:
+                    handler = methods[method]
+                    return lambda project, body, query: handler(project, body, query, *match.groups())
+            return None
+
+        def index(self, project, body, query):
+            # The stack offers every component of the source project
+            with api.lock:
+                return 200, {'components': [{'id': component_id} for component_id in api.projects[SOURCE_TOKEN]]}
+
+        def verify_token(self, project, body, query):
+            return 200, {'id': '1', 'isMasterToken': True, 'admin': {'role': 'admin'}}
+
+        def list_branches(self, project, body, query):
+            return 200, [{'id': 1, 'name': 'Main', 'isDefault': True}]
+
+        def list_components(self, project, body, query):
+            include = query.get('include', [''])[0].split(',')
+            with api.lock:
+                return 200, [{'id': component_id, 'configurations': [listing(config, include) for config in configs.values()]}
+                             for component_id, configs in project.items()]
+
+        def list_configs(self, project, body, query, component_id):
+            with api.lock:
+                return 200, [dict(config) for config in project.get(component_id, {}).values()]
+
+        def get_config(self, project, body, query, component_id, config_id):
+            with api.lock:
+                config = project.get(component_id, {}).get(config_id)
+            return (200, config) if config else (404, {'error': 'Configuration not found'})
+
+        def create_config(self, project, body, query, component_id):
+            with api.lock:
+                configs = project.setdefault(component_id, {})
+                if body['configurationId'] in configs:
+                    return 400, {'error': 'Configuration already exists'}
+                configs[body['configurationId']] = {'id': body['configurationId'], 'name': body.get('name', ''), 'description': body.get('description', ''),
+                                                    'configuration': body.get('configuration') or {}, 'rows': []}
+                return 201, configs[body['configurationId']]
+
+        def update_config(self, project, body, query, component_id, config_id):
+            with api.lock:
+                config = project.get(component_id, {}).get(config_id)
+                if config is None:
+                    return 404, {'error': 'Configuration not found'}
+                config.update({key: body[key] for key in ('name', 'description', 'configuration') if key in body})
+                return 200, config
+
+        def get_metadata(self, project, body, query, component_id, config_id):
+            return 200, [{'id': '1', 'key': FOLDER_METADATA_KEY, 'value': 'Benchmark', 'provider': 'user'}]
+
+        def set_metadata(self, project, body, query, component_id, config_id):
+            return 201, [{'key': value, 'value': body.get(key.replace('[key]', '[value]'))} for key, value in body.items() if key.endswith('[key]')]
+
+        def create_row(self, project, body, query, component_id, config_id):
+            with api.lock:
+                config = project.get(component_id, {}).get(config_id)
+                if config is None:
+                    return 404, {'error': 'Configuration not found'}
+                if any(row['id'] == body['rowId'] for row in config['rows']):
+                    return 400, {'error': 'Row already exists'}
+                row = {'id': body['rowId'], 'name': body.get('name', ''), 'description': body.get('description', ''),
+                       'configuration': body.get('configuration') or {}}
+                config['rows'].append(row)
+                return 201, row
+
+        def update_row(self, project, body, query, component_id, config_id, row_id):
+            with api.lock:
+                config = project.get(component_id, {}).get(config_id)
+                row = next((row for row in (config or {}).get('rows', []) if row['id'] == row_id), None)
+                if row is None:
+                    return 404, {'error': 'Row not found'}
+                row.update({key: body[key] for key in ('name', 'description', 'configuration') if key in body})
+                return 200, row
+
+        def do_GET(self):
+            self.handle_request('GET')
+
+        def do_POST(self):
+            self.handle_request('POST')
+
+        def do_PUT(self):
+            self.handle_request('PUT')
+
+    return Handler
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Local mock of the Keboola Storage API for benchmarks. '
+                                                 f'Token "{SOURCE_TOKEN}" is the synthetic source project, any other token an empty destination.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=0, help='0 picks a free port; the address is printed on the first line')
+    parser.add_argument('--components', type=int, default=10)
+    parser.add_argument('--configs', type=int, default=100)
+    parser.add_argument('--rows', type=int, default=3, help='Rows per configuration')
+    parser.add_argument('--payload-bytes', type=int, default=512, help='Configuration payload of every config and row')
+    parser.add_argument('--latency-ms', type=float, default=0)
+    parser.add_argument('--jitter-ms', type=float, default=0, help='Uniform random latency added on top of --latency-ms')
+    parser.add_argument('--rate-429', type=float, default=0.0, help='Share of requests answered with 429 and Retry-After')
+    parser.add_argument('--rate-5xx', type=float, default=0.0, help='Share of requests answered with 500, 502 or 503')
+    parser.add_argument('--retry-after', type=float, default=0.5, help='Seconds sent in the Retry-After header of injected 429s')
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    api = MockStorageAPI(build_source_project(args.components, args.configs, args.rows, args.payload_bytes),
+                         args.latency_ms, args.jitter_ms, args.rate_429, args.rate_5xx, args.retry_after, args.seed)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(api))
+    server.daemon_threads = True
+    print(f'Listening on http://{args.host}:{server.server_address[1]}/', flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,193 @@
+import argparse
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+# End-to-end migration benchmarks against bench/mock_storage_api.py. Every scenario gets a fresh mock server and runs the
+# migration engine in a fresh process, so peak memory and the adaptive limiters are measured per scenario.
+bench_dir = os.path.dirname(os.path.abspath(__file__))
+app_dir = os.path.join(os.path.dirname(bench_dir), 'app')
+
+DEFAULT_SIZES = (100, 1000, 10000)
+BASELINE_PATH = os.path.join(bench_dir, 'baseline.json')
+RESULTS_PATH = os.path.join(bench_dir, 'results.json')
+# Allowed relative change against the baseline before a scenario counts as a regression
+DEFAULT_THRESHOLD = 0.2
+# Options forwarded to the mock server; the baseline is only comparable when they match
+SERVER_OPTIONS = ('components', 'rows', 'payload_bytes', 'latency_ms', 'jitter_ms', 'rate_429', 'rate_5xx', 'retry_after', 'seed')
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def start_server(args, configs):
+    command = [sys.executable, os.path.join(bench_dir, 'mock_storage_api.py'), '--configs', str(configs)]
+    for option in SERVER_OPTIONS:
+        command += [f"--{option.replace('_', '-')}", str(getattr(args, option))]
+    server = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    line = server.stdout.readline()
+    if not line.startswith('Listening on '):
+        server.kill()
+        raise RuntimeError(f'Mock Storage API did not start: {line!r}')
+    return server, line.split('Listening on ', 1)[1].strip()
+
+
+def run_scenario(url, mode, global_in_flight, destination_in_flight, results):
+    # Runs in a child process: imports the app the same way migrate_cli does and migrates one destination
+    sys.path.insert(0, app_dir)
+    import async_engine
+    from engine import load_source_snapshot
+    from fanout import migrate_destinations
+    from keboola_client import get_client
+    from metrics import get_metrics
+    from streaming import stream_destinations
+
+    # log.csv and friends go to a scratch directory
+    os.chdir(tempfile.mkdtemp(prefix='migration-bench-'))
+    destination = {'name': 'bench-destination', 'url': url, 'token': 'destination'}
+    source_client = get_client(url, 'source')
+    metrics = get_metrics()
+    metrics.reset()
+
+    started = time.monotonic()
+    if mode == 'stream':
+        summaries = stream_destinations(source_client, 'bench-source', [destination], global_in_flight=global_in_flight,
+                                        destination_in_flight=destination_in_flight)
+    elif mode == 'asyncio':
+        snapshot = async_engine.load_source_snapshot({'name': 'bench-source', 'url': url, 'token': 'source'}, global_in_flight=global_in_flight)
+        summaries = async_engine.migrate_destinations(snapshot, [destination], global_in_flight=global_in_flight, destination_in_flight=destination_in_flight)
+    else:
+        snapshot = load_source_snapshot(source_client, 'bench-source')
+        summaries = migrate_destinations(snapshot, [destination], global_in_flight=global_in_flight, destination_in_flight=destination_in_flight)
+    seconds = time.monotonic() - started
+
+    snapshot = metrics.snapshot()
+    summary = summaries['bench-destination']
+    requests_made = sum(item['requests'] for item in snapshot['endpoints'].values())
+    retries = sum(sum(item['retries'].values()) for item in snapshot['endpoints'].values())
+    results.put({
+        'seconds': round(seconds, 3),
+        'configs_migrated': summary['migrated'],
+        'configs_failed': summary['failed'],
+        'error': summary['error'],
+        'configs_per_second': round(summary['migrated'] / seconds, 2) if seconds else 0.0,
+        'requests': requests_made,
+        'retries': retries,
+        'requests_per_config': round((requests_made - retries) / max(1, summary['migrated']), 3),
+        'peak_rss_mb': peak_rss_mb(),
+    })
+
+
+def run_benchmark(args, configs, mode):
+    server, url = start_server(args, configs)
+    try:
+        context = multiprocessing.get_context('spawn')
+        results = context.Queue()
+        process = context.Process(target=run_scenario, args=(url, mode, args.global_in_flight, args.destination_in_flight, results))
+        process.start()
+        process.join()
+        if process.exitcode != 0:
+            raise RuntimeError(f'{mode} benchmark of {configs} configs exited with code {process.exitcode}')
+        result = results.get(timeout=5)
+    finally:
+        server.terminate()
+        server.wait()
+    return dict(result, configs=configs, mode=mode)
+
+
+def compare(result, baseline, threshold):
+    # Slower, hungrier or chattier than the baseline by more than the threshold
+    regressions = []
+    if result['configs_per_second'] < baseline['configs_per_second'] * (1 - threshold):
+        regressions.append(f"throughput {result['configs_per_second']} configs/s vs {baseline['configs_per_second']}")
+    if result['peak_rss_mb'] and baseline.get('peak_rss_mb') and result['peak_rss_mb'] > baseline['peak_rss_mb'] * (1 + threshold):
+        regressions.append(f"peak memory {result['peak_rss_mb']} MB vs {baseline['peak_rss_mb']}")
+    if result['requests_per_config'] > baseline['requests_per_config'] * (1 + threshold):
+        regressions.append(f"requests per config {result['requests_per_config']} vs {baseline['requests_per_config']}")
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark migrations against a local mock Storage API and check for regressions.')
+    parser.add_argument('--sizes', default=','.join(str(size) for size in DEFAULT_SIZES), help='Comma separated numbers of configurations')
+    parser.add_argument('--mode', choices=('snapshot', 'stream', 'asyncio'), action='append', help='Migration mode, repeatable (default: snapshot)')
+    parser.add_argument('--components', type=int, default=10)
+    parser.add_argument('--rows', type=int, default=3)
+    parser.add_argument('--payload-bytes', type=int, default=512)
+    parser.add_argument('--latency-ms', type=float, default=20)
+    parser.add_argument('--jitter-ms', type=float, default=10)
+    parser.add_argument('--rate-429', type=float, default=0.01)
+    parser.add_argument('--rate-5xx', type=float, default=0.005)
+    parser.add_argument('--retry-after', type=float, default=0.5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--global-in-flight', type=int, default=64)
+    parser.add_argument('--destination-in-flight', type=int, default=16)
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--output', default=RESULTS_PATH)
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument('--update-baseline', action='store_true', help='Store these results as the new baseline instead of comparing')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    sizes = [int(size) for size in args.sizes.split(',') if size.strip()]
+    modes = args.mode or ['snapshot']
+    parameters = {option: getattr(args, option) for option in SERVER_OPTIONS}
+    parameters.update(global_in_flight=args.global_in_flight, destination_in_flight=args.destination_in_flight)
+
+    results = {}
+    for mode in modes:
+        for configs in sizes:
+            result = run_benchmark(args, configs, mode)
+            results[f'{mode}-{configs}'] = result
+            print(f"{mode:>8} {configs:>6} configs: {result['seconds']:>8.2f} s, {result['configs_per_second']:>8.2f} configs/s, "
+                  f"{result['requests']} requests ({result['retries']} retries), {result['requests_per_config']} per config, "
+                  f"peak {result['peak_rss_mb']} MB" + (f", {result['configs_failed']} failed" if result['configs_failed'] else '')
+                  + (f", error: {result['error']}" if result['error'] else ''), flush=True)
+
+    with open(args.output, 'w', encoding='utf-8') as file:
+        json.dump({'parameters': parameters, 'results': results}, file, indent=2)
+
+    if args.update_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as file:
+            json.dump({'parameters': parameters, 'results': results}, file, indent=2)
+        print(f'Baseline saved to {args.baseline}')
+        return 0
+
+    failed = [key for key, result in results.items() if result['configs_failed'] or result['error']]
+    if not os.path.exists(args.baseline):
+        print(f'No baseline at {args.baseline}, run with --update-baseline to create one')
+        return 1 if failed else 0
+
+    with open(args.baseline, 'r', encoding='utf-8') as file:
+        baseline = json.load(file)
+    if baseline['parameters'] != parameters:
+        print('Baseline was recorded with different parameters, not comparing')
+        return 1 if failed else 0
+
+    regressed = False
+    for key, result in results.items():
+        if key not in baseline['results']:
+            continue
+        for regression in compare(result, baseline['results'][key], args.threshold):
+            regressed = True
+            print(f'REGRESSION {key}: {regression}')
+    if not regressed:
+        print(f'No regressions beyond {args.threshold:.0%} against {args.baseline}')
+    return 1 if regressed or failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
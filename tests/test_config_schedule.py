@@ -0,0 +1,111 @@
+import csv
+from config_migrator import ConfigSchedule
+from dependency_graph import DependencyGraph
+from journal import RunJournal
+
+
+def make_config(component_id, config_id, **configuration):
+    return {'component_id': component_id, 'id': config_id, 'name': f'{component_id} {config_id}', 'configuration': configuration, 'rows': []}
+
+
+def flow(config_id, *targets):
+    return make_config('keboola.orchestrator', config_id, tasks=[{'task': {'componentId': component_id, 'configId': target}}
+                                                                 for component_id, target in targets])
+
+
+VARIABLES = make_config('keboola.variables', '1')
+SHARED_CODE = make_config('keboola.shared-code', '2')
+TRANSFORMATION = make_config('keboola.snowflake-transformation', '3', variables_id='1', shared_code_id='2')
+EXTRACTOR = make_config('keboola.ex-db-snowflake', '4')
+FLOW = flow('5', ('keboola.snowflake-transformation', '3'), ('keboola.ex-db-snowflake', '4'))
+SCHEDULER = make_config('keboola.scheduler', '6', target={'componentId': 'keboola.orchestrator', 'configurationId': '5'})
+CONFIGS = [SCHEDULER, FLOW, TRANSFORMATION, EXTRACTOR, SHARED_CODE, VARIABLES]
+
+
+def key(config):
+    return (config['component_id'], config['id'])
+
+
+def success():
+    return (True, ['migrated'], None)
+
+
+def failure():
+    return (False, ['FAILED'], None)
+
+
+def test_waves_follow_references():
+    waves = DependencyGraph(CONFIGS).waves()
+
+    assert [sorted(wave) for wave in waves] == [
+        sorted([key(VARIABLES), key(SHARED_CODE), key(EXTRACTOR)]),
+        [key(TRANSFORMATION)],
+        [key(FLOW)],
+        [key(SCHEDULER)],
+    ]
+
+
+def test_waves_ignore_references_outside_the_migration():
+    waves = DependencyGraph([TRANSFORMATION, FLOW]).waves()
+
+    assert waves == [[key(TRANSFORMATION)], [key(FLOW)]]
+
+
+def test_waves_put_cycles_last():
+    first = flow('10', ('keboola.orchestrator', '11'))
+    second = flow('11', ('keboola.orchestrator', '10'))
+
+    waves = DependencyGraph([first, second, EXTRACTOR]).waves()
+
+    assert waves[0] == [key(EXTRACTOR)]
+    assert sorted(waves[-1]) == sorted([key(first), key(second)])
+
+
+def test_schedule_releases_dependents_once_everything_landed():
+    schedule = ConfigSchedule(CONFIGS)
+
+    assert sorted(schedule.start()) == sorted([key(VARIABLES), key(SHARED_CODE), key(EXTRACTOR)])
+    assert schedule.record(key(VARIABLES), success()) == []
+    assert schedule.record(key(SHARED_CODE), success()) == [key(TRANSFORMATION)]
+    assert schedule.record(key(TRANSFORMATION), success()) == []
+    assert schedule.record(key(EXTRACTOR), success()) == [key(FLOW)]
+    assert schedule.record(key(FLOW), success()) == [key(SCHEDULER)]
+    assert schedule.record(key(SCHEDULER), success()) == []
+    assert schedule.fails == []
+    assert not schedule.pending
+
+
+def test_failure_cascades_to_every_dependent(tmp_path):
+    csv_path = tmp_path / 'log.csv'
+    progress = []
+    with RunJournal(str(csv_path)) as journal:
+        schedule = ConfigSchedule(CONFIGS, lambda config, ok, messages: progress.append((key(config), ok)), journal=journal,
+                                  source_name='source', destination_name='destination')
+        schedule.start()
+        schedule.record(key(VARIABLES), success())
+        schedule.record(key(EXTRACTOR), success())
+
+        assert schedule.record(key(SHARED_CODE), failure()) == []
+
+    # The transformation, the flow running it and the scheduler of the flow are never started
+    assert schedule.failed == {key(SHARED_CODE), key(TRANSFORMATION), key(FLOW), key(SCHEDULER)}
+    assert [config['id'] for config in schedule.fails] == ['2', '3', '5', '6']
+    assert progress[-3:] == [(key(TRANSFORMATION), False), (key(FLOW), False), (key(SCHEDULER), False)]
+    assert not schedule.pending
+
+    # Only the configs skipped by the cascade are journaled here, the failed one is journaled by migrate_config
+    with open(csv_path, newline='', encoding='utf-8') as file:
+        records = list(csv.DictReader(file))
+    assert [(record['ConfigurationId'], record['Status']) for record in records] == [('3', 'Failed'), ('5', 'Failed'), ('6', 'Failed')]
+    assert 'dependency failed: keboola.shared-code/2' in records[0]['StatusText']
+    assert 'dependency failed: keboola.snowflake-transformation/3' in records[1]['StatusText']
+
+
+def test_release_cycles_starts_what_is_left():
+    first = flow('10', ('keboola.orchestrator', '11'))
+    second = flow('11', ('keboola.orchestrator', '10'))
+    schedule = ConfigSchedule([first, second])
+
+    assert schedule.start() == []
+    assert sorted(schedule.release_cycles()) == sorted([key(first), key(second)])
+    assert not schedule.pending
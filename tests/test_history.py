@@ -0,0 +1,68 @@
+import csv
+import sqlite3
+from history import HistoryStore
+from journal import JOURNAL_COLUMNS
+
+
+def journal_record(config_id, status='Success', status_text='migrated'):
+    return {'ComponentId': 'keboola.ex-db-snowflake', 'SourceProject': 'source', 'DestinationProject': 'destination',
+            'ConfigurationId': config_id, 'ConfigurationName': f'Config {config_id}', 'DateTime': '2024-01-02 03:04:05',
+            'Status': status, 'StatusText': status_text, 'DurationMs': '12', 'Requests': '2', 'HttpStatus': '201',
+            'BytesSent': '100', 'BytesReceived': '200'}
+
+
+def append_records(csv_path, records):
+    new_file = not csv_path.exists()
+    with open(csv_path, mode='a', newline='', encoding='utf-8') as file:
+        writer = csv.DictWriter(file, fieldnames=JOURNAL_COLUMNS)
+        if new_file:
+            writer.writeheader()
+        writer.writerows(records)
+
+
+def imported_ids(store):
+    return sorted(row['config_id'] for row in store.query())
+
+
+def test_import_resumes_at_the_stored_offset(tmp_path):
+    csv_path = tmp_path / 'log.csv'
+    store = HistoryStore(str(tmp_path / 'history.db'))
+    append_records(csv_path, [journal_record('1'), journal_record('2', 'Failed', 'FAILED: first line\nsecond line')])
+
+    assert store.import_csv(str(csv_path)) == 2
+    assert store.import_csv(str(csv_path)) == 0
+
+    append_records(csv_path, [journal_record('3')])
+
+    assert store.import_csv(str(csv_path)) == 1
+    assert imported_ids(store) == ['1', '2', '3']
+    assert [run['configs'] for run in store.runs()] == [1, 2]
+    assert store.query(config_id='2')[0]['status_text'] == 'FAILED: first line\nsecond line'
+
+
+def test_import_skips_records_counted_by_an_older_store(tmp_path):
+    csv_path = tmp_path / 'log.csv'
+    db_path = tmp_path / 'history.db'
+    append_records(csv_path, [journal_record('1'), journal_record('2'), journal_record('3')])
+    # Stores created before byte offsets only counted the imported records
+    with sqlite3.connect(db_path) as connection:
+        connection.execute('CREATE TABLE imports (csv_path TEXT PRIMARY KEY, records INTEGER NOT NULL)')
+        connection.execute('INSERT INTO imports VALUES (?, ?)', (str(csv_path.resolve()), 2))
+    connection.close()
+    store = HistoryStore(str(db_path))
+
+    assert store.import_csv(str(csv_path)) == 1
+    assert imported_ids(store) == ['3']
+
+    # From then on the offset is used
+    append_records(csv_path, [journal_record('4')])
+
+    assert store.import_csv(str(csv_path)) == 1
+    assert imported_ids(store) == ['3', '4']
+
+
+def test_import_of_a_missing_log_reads_nothing(tmp_path):
+    store = HistoryStore(str(tmp_path / 'history.db'))
+
+    assert store.import_csv(str(tmp_path / 'log.csv')) == 0
+    assert store.runs() == []
@@ -0,0 +1,50 @@
+import datetime
+import email.utils
+import pytest
+import requests
+from keboola_client import BACKOFF_MAX, get_retry_after, is_compression_rejected
+
+
+def make_response(status_code, text='', headers=None):
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = text.encode('utf-8')
+    response.headers.update(headers or {})
+    return response
+
+
+@pytest.mark.parametrize('status_code, text, rejected', [
+    (415, '', True),
+    (400, '{"error": "Invalid JSON in request body: Syntax error"}', True),
+    (400, 'Content-Encoding gzip is not supported', True),
+    (400, '{"error": "Configuration already exists"}', False),
+    (500, 'gzip', False),
+    (201, '{}', False),
+])
+def test_is_compression_rejected(status_code, text, rejected):
+    assert is_compression_rejected(make_response(status_code, text)) is rejected
+
+
+@pytest.mark.parametrize('value, delay', [
+    ('2', 2.0),
+    ('0.5', 0.5),
+    ('-3', 0.0),
+    ('86400', BACKOFF_MAX),
+    ('soon', None),
+    ('', None),
+])
+def test_get_retry_after_seconds(value, delay):
+    assert get_retry_after(make_response(429, headers={'Retry-After': value})) == delay
+
+
+def test_get_retry_after_http_date():
+    retry_at = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=10)
+
+    delay = get_retry_after(make_response(503, headers={'Retry-After': email.utils.format_datetime(retry_at, usegmt=True)}))
+
+    assert 8 <= delay <= 10
+
+
+def test_get_retry_after_without_header():
+    assert get_retry_after(make_response(429)) is None
+    assert get_retry_after(None) is None